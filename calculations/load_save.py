@@ -1,5 +1,34 @@
+import os
+import sys
 import pickle
 
+# shared helpers live next to the PCB code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'opm_coil_fork'))
+from artifacts import save_artifact, load_artifact
+
+def load_windings(filename):
+    """Load a design saved by generate_windings, memory-mapped.
+
+    Returns the coil mesh as a dict of vertices and faces, the loops and
+    the target points, like load_coil_mesh, load_loops and
+    load_target_points, see artifacts.load_artifact.
+    """
+    artifact = load_artifact(filename)
+    coilmesh = {'vertices': artifact['vertices'], 'faces': artifact['faces']}
+    return coilmesh, artifact['loops'], artifact['target_points']
+
+def pickles_to_artifact(coilmesh_filename, loops_filename,
+                        target_points_filename, filename, params=None):
+    """Convert the pickles of an older design to one artifact file.
+
+    Only convert pickles you made yourself, unpickling runs code.
+    """
+    coilmesh = load_coil_mesh(coilmesh_filename)
+    save_artifact(filename, loops=load_loops(loops_filename), params=params,
+                  vertices=coilmesh['vertices'], faces=coilmesh['faces'],
+                  target_points=load_target_points(target_points_filename))
+
 def save_coil_mesh(vertices, faces, filename='coilmesh1.pkl'):
     """Save the coil mesh vertices and faces to a file."""
     with open(filename, 'wb') as f:
@@ -23,4 +52,4 @@ def load_loops(filename):
 def load_target_points(filename):
     """Load the target points from a file."""
     with open(filename, 'rb') as f:
-        return pickle.load(f)
\ No newline at end of file
+        return pickle.load(f)
@@ -1,6 +1,18 @@
+import os
+import sys
+from collections import OrderedDict
 import numpy as np
 from bfieldtools.mesh_conductor import MeshConductor
-from bfieldtools.line_conductor import LineConductor
+
+# shared helpers live next to the PCB code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'opm_coil_fork'))
+from biot_savart import magnetic_field, loop_segments
+from mesh_cache import hash_key
+
+# unit-current fields by (segments, points, dtype), oldest dropped first
+_unit_fields = OrderedDict()
+MAX_CACHED_FIELDS = 32
 
 def create_mesh_conductor(vertices, faces):
     """Create a MeshConductor object."""
@@ -12,15 +24,117 @@ def create_mesh_conductor(vertices, faces):
         N_suh=400,
     )
 
-def calculate_magnetic_field_at_points(loops, points, currents_mA):
-    """Calculate the magnetic field at given points for a range of currents."""
-    line_conductor = LineConductor(loops=loops)
-    B_fields_at_points = []
+def calculate_magnetic_field(loops, points, dtype=np.float64):
+    """Calculate the magnetic field of a unit current (1 A) in the loops.
+
+    The loops are closed like in bfieldtools' LineConductor, dtype can be
+    np.float32 for faster, less precise evaluation on large grids. Repeated
+    calls with the same loops and points return the cached field.
+    """
+    segments = loop_segments(loops)
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    key = hash_key(segments, points, np.dtype(dtype).str)
+    if key in _unit_fields:
+        _unit_fields.move_to_end(key)
+        return _unit_fields[key]
+
+    field = magnetic_field(segments, points, dtype=dtype)
+    field.setflags(write=False)     # shared between callers
+    _unit_fields[key] = field
+    if len(_unit_fields) > MAX_CACHED_FIELDS:
+        _unit_fields.popitem(last=False)
+    return field
+
+class CoilResponse:
+    """Field of one or more coils at fixed points, linear in the currents.
+
+    The unit-current field of each coil is computed once, the field for any
+    currents is then a weighted sum of those.
+
+    Parameters
+    ----------
+    coils : dict | list
+        The loops of each coil, either as a dict of name -> loops or as a
+        list of loops.
+    points : array, shape (n_points, 3)
+        The points where the field is computed.
+    dtype : np.float32 | np.float64
+        The precision of the unit field computation.
+
+    Attributes
+    ----------
+    names : list
+        The coil names, or indices if coils was a list.
+    unit_fields : array, shape (n_coils, n_points, 3)
+        The field of 1 A in each coil in T.
+    """
 
-    for current_mA in currents_mA:
-        current_A = current_mA * 1e-3  # Convert mA to A
-        B_field_unit_current = line_conductor.magnetic_field(points)
-        B_field_at_points = B_field_unit_current * current_A
-        B_fields_at_points.append(B_field_at_points)
+    def __init__(self, coils, points, dtype=np.float64):
+        if not isinstance(coils, dict):
+            coils = dict(enumerate(coils))
+        self.names = list(coils)
+        self.points = np.atleast_2d(np.asarray(points, dtype=float))
+        self.unit_fields = np.array([
+            calculate_magnetic_field(loops, self.points, dtype=dtype)
+            for loops in coils.values()])
 
-    return np.array(B_fields_at_points)
+    def _current_vector(self, currents):
+        if isinstance(currents, dict):
+            unknown = set(currents) - set(self.names)
+            if unknown:
+                raise ValueError(f"Unknown coils {sorted(unknown)}. Must be "
+                                 f"in {self.names}.")
+            currents = np.broadcast_arrays(
+                *[np.asarray(currents.get(name, 0.), dtype=float)
+                  for name in self.names])
+            return np.stack(currents, axis=-1)
+        currents = np.asarray(currents, dtype=float)
+        if currents.shape[-1:] != (len(self.names),):
+            raise ValueError(f"Expected {len(self.names)} currents in the "
+                             f"last axis, got shape {currents.shape}.")
+        return currents
+
+    def field(self, currents):
+        """Superposed field of all coils.
+
+        Parameters
+        ----------
+        currents : array, shape (..., n_coils) | dict
+            The current in A in each coil, e.g. one row per step of a
+            sweep. A dict maps coil names to currents (or arrays of
+            currents), missing coils carry no current.
+
+        Returns
+        -------
+        field : array, shape (..., n_points, 3)
+            The field in T.
+        """
+        return np.tensordot(self._current_vector(currents), self.unit_fields,
+                            axes=(-1, 0))
+
+    def sweep(self, currents, coil=None):
+        """Field of one coil for each of the given currents.
+
+        Parameters
+        ----------
+        currents : array, shape (n_currents,)
+            The currents in A.
+        coil : str | int | None
+            The coil name. Can be None if there is only one coil.
+
+        Returns
+        -------
+        field : array, shape (n_currents, n_points, 3)
+            The field in T.
+        """
+        if coil is None:
+            if len(self.names) != 1:
+                raise ValueError("coil must be given for several coils.")
+            coil = self.names[0]
+        unit_field = self.unit_fields[self.names.index(coil)]
+        return np.asarray(currents, dtype=float)[:, None, None] * unit_field
+
+def calculate_magnetic_field_at_points(loops, points, currents_mA):
+    """Calculate the magnetic field at given points for a range of currents."""
+    currents_A = np.asarray(currents_mA) * 1e-3  # Convert mA to A
+    return CoilResponse([loops], points).sweep(currents_A)
@@ -1,13 +1,20 @@
+import os
+import sys
 import numpy as np
 import trimesh
-import pickle
-from bfieldtools.mesh_conductor import MeshConductor
-from bfieldtools.coil_optimize import optimize_streamfunctions
-from bfieldtools.contour import scalar_contour
 import pkg_resources
-import mosek
 
-def generate_windings(coil_type, new_radius_scale=0.73/2, new_height_scale=0.50/2, n_contours=3):
+# shared helpers live next to the PCB code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'opm_coil_fork'))
+from mesh_cache import mesh_conductor, B_coupling
+from artifacts import save_artifact
+from contours import scalar_contour
+from solvers import get_backend
+from stream_solver import StreamFunctionSolver
+
+def generate_windings(coil_type, new_radius_scale=0.73/2, new_height_scale=0.50/2, n_contours=3,
+                      cache=None, backend=None, num_threads=8):
     """
     Generate windings for the coil.
 
@@ -21,6 +28,14 @@ def generate_windings(coil_type, new_radius_scale=0.73/2, new_height_scale=0.50/
         How many contours the windings should take, by default 3
     coil_type : str, optional
         The coil type, expects either 'X','Y','Z' based on the sheilded rooms reference frame, by default 'Y'
+    cache : MeshCache | str | bool | None, optional
+        On-disk cache for the mesh basis and coupling matrix, see
+        mesh_cache.get_cache. False disables caching, by default None
+    backend : SolverBackend | str | None, optional
+        The solver backend, see solvers.get_backend. By default MOSEK if
+        installed, otherwise Clarabel
+    num_threads : int, optional
+        The number of solver threads if backend is not a SolverBackend, by default 8
 
     Returns
     -------
@@ -55,12 +70,13 @@ def generate_windings(coil_type, new_radius_scale=0.73/2, new_height_scale=0.50/
 
 
     # Create MeshConductor
-    coil = MeshConductor(
-        verts=coilmesh1.vertices,
-         tris=coilmesh1.faces,
+    coil = mesh_conductor(
+        coilmesh1.vertices,
+        coilmesh1.faces,
         fix_normals=True,
         basis_name="suh",
         N_suh=400,
+        cache=cache,
     )
 
     # Define target points
@@ -89,18 +105,19 @@ def generate_windings(coil_type, new_radius_scale=0.73/2, new_height_scale=0.50/
 
     # Create bfield specifications
     target_spec = {
-        "coupling": coil.B_coupling(target_points),
+        "coupling": B_coupling(coil, target_points, cache=cache),
         "abs_error": 0.01,
         "target": target_field,
     }
 
+    stream_solver = StreamFunctionSolver(
+        get_backend(backend, num_threads=num_threads), warm_start=False)
+
     try:
-        coil.s, prob = optimize_streamfunctions(
+        coil.s, prob = stream_solver.solve(
             coil,
             [target_spec],
             objective="minimum_inductive_energy",
-            solver="MOSEK",
-            solver_opts={"mosek_params": {mosek.iparam.num_threads: 8}},
         )
     except Exception as e:
         print(f"Optimization failed: {e}")
@@ -109,36 +126,13 @@ def generate_windings(coil_type, new_radius_scale=0.73/2, new_height_scale=0.50/
     if coil.s is not None:
         loops = scalar_contour(coil.mesh, coil.s.vert, N_contours=n_contours)
 
-        #Save the data for the coil through Pickle to make use of faster code testing and debugging
-        if coil_type == 'X':
-            with open('coilmesh_X.pkl', 'wb') as f:
-                pickle.dump({'vertices': coilmesh1.vertices, 'faces': coilmesh1.faces}, f)
-
-            with open('loops_X.pkl', 'wb') as f:
-                pickle.dump(loops, f)
-
-            with open('target_points_X.pkl', 'wb') as f:
-                pickle.dump(target_points, f)
-
-        if coil_type == 'Y':
-            with open('coilmesh_Y.pkl', 'wb') as f:
-                pickle.dump({'vertices': coilmesh1.vertices, 'faces': coilmesh1.faces}, f)
-
-            with open('loops_Y.pkl', 'wb') as f:
-                pickle.dump(loops, f)
-
-            with open('target_points_Y.pkl', 'wb') as f:
-                pickle.dump(target_points, f)
-        
-        if coil_type == 'Z':
-            with open('coilmesh_Z.pkl', 'wb') as f:
-                pickle.dump({'vertices': coilmesh1.vertices, 'faces': coilmesh1.faces}, f)
-
-            with open('loops_Z.pkl', 'wb') as f:
-                pickle.dump(loops, f)
-
-            with open('target_points_Z.pkl', 'wb') as f:
-                pickle.dump(target_points, f)
+        # Save the design for faster code testing and debugging
+        save_artifact(f'windings_{coil_type}.npz', loops=loops, params=dict(
+            coil_type=coil_type, new_radius_scale=new_radius_scale,
+            new_height_scale=new_height_scale, n_contours=n_contours),
+            vertices=coilmesh1.vertices, faces=coilmesh1.faces,
+            stream_function=coil.s.vert, target_points=target_points,
+            target_field=target_field)
 
         return True
     else:
@@ -1,6 +1,47 @@
-from .biplanar_coil import (BiplanarCoil, get_sphere_points, get_target_field,
-                            get_2D_point_grid)
-from .panels import (PCBPanel, plot_field_colormap, plot_field_arrows,
-                     load_panel, plot_panel, check_half_names)
+"""Design of biplanar and cylindrical coils and of their PCB panels.
+
+The names below and the submodules are imported when they are first used,
+so that importing the package, e.g. in a headless batch worker, does not
+load pyvista, matplotlib, the solvers or bfieldtools.
+"""
+
+import importlib
 
 __version__ = '0.1.dev0'
+
+# the public names, by the submodule they are defined in
+_LAZY_NAMES = {
+    'biplanar_coil': ('BiplanarCoil', 'get_sphere_points',
+                      'get_target_field', 'get_2D_point_grid'),
+    'panels': ('PCBPanel', 'plot_field_colormap', 'plot_field_arrows',
+               'load_panel', 'plot_panel', 'check_half_names'),
+}
+_LAZY_ATTRS = {name: module for module, names in _LAZY_NAMES.items()
+               for name in names}
+
+# the submodules that can be used as attributes of the package, i.e. all
+# but the scripts, e.g. import_time and sph_harmonics
+_SUBMODULES = ('artifacts', 'batch', 'biot_savart', 'biplanar_coil',
+               'contours', 'cut_planner', 'file_io', 'flatten_windings',
+               'line_drawer', 'make_pcb', 'mesh_cache', 'metrics',
+               'new_coil_generation', 'panels', 'segment_tools', 'simplify',
+               'solvers', 'stream_solver', 'sweep', 'utils')
+
+__all__ = sorted(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        module = importlib.import_module(f'.{_LAZY_ATTRS[name]}', __name__)
+        value = getattr(module, name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(f'.{name}', __name__)
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    # later lookups do not come here again
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS) | set(_SUBMODULES))
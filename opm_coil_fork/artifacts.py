@@ -0,0 +1,163 @@
+"""Versioned, memory-mappable files of coil designs.
+
+A design, i.e. the mesh, stream function, loops, target points and field
+and the parameters it was generated with, is stored as one uncompressed
+.npz file with a schema version. The loops are stored as one array of
+points plus the offset of each loop. On load, the arrays are memory-mapped
+straight from the file, so even large designs open instantly, and nothing
+is unpickled.
+"""
+
+import os
+import json
+import struct
+import zipfile
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# bump when the stored arrays or their meaning change
+SCHEMA_VERSION = 1
+
+
+def pack_loops(loops):
+    """Loops as one ragged array.
+
+    Parameters
+    ----------
+    loops : list of array, shape (n_points, 3)
+        The loops.
+
+    Returns
+    -------
+    points : array, shape (n_points_total, 3)
+        The points of all loops, loop after loop.
+    offsets : array of int, shape (n_loops + 1,)
+        Where each loop starts in points, and the total number of points.
+    """
+    loops = [np.asarray(loop, dtype=float).reshape(-1, 3) for loop in loops]
+    offsets = np.concatenate(([0], np.cumsum([len(loop) for loop in loops])))
+    points = np.concatenate(loops) if loops else np.zeros((0, 3))
+    return points, offsets.astype(np.int64)
+
+
+def unpack_loops(points, offsets):
+    """The loops of a ragged array, as views, see :func:`pack_loops`."""
+    return [points[start:stop] for start, stop in zip(offsets[:-1],
+                                                      offsets[1:])]
+
+
+def save_artifact(fname, loops=None, params=None, **arrays):
+    """Save a design.
+
+    Parameters
+    ----------
+    fname : str | Path
+        The .npz file, replaced atomically.
+    loops : list of array, shape (n_points, 3) | None
+        The loops, stored as loop_points and loop_offsets.
+    params : dict | None
+        The parameters the design was generated with. Must be JSON
+        serializable.
+    **arrays : dict of array
+        The other arrays, e.g. vertices, faces, stream_function,
+        target_points and target_field.
+    """
+    fname = Path(fname)
+    arrays = {name: np.asarray(value) for name, value in arrays.items()}
+    for name, value in arrays.items():
+        if value.dtype.hasobject:
+            raise ValueError(f'{name} is not a numeric array.')
+    if loops is not None:
+        arrays['loop_points'], arrays['loop_offsets'] = pack_loops(loops)
+    arrays['schema_version'] = np.array(SCHEMA_VERSION)
+    # numpy scalars in the parameters are stored as plain numbers
+    arrays['params'] = np.array(json.dumps(
+        params or dict(), sort_keys=True,
+        default=lambda value: np.asarray(value).tolist()))
+
+    # write to a temporary file first, like MeshCache.save
+    fd, tmp_fname = tempfile.mkstemp(dir=fname.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            np.savez(fp, **arrays)
+        # mkstemp makes the file private, designs are meant to be shared
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_fname, 0o666 & ~umask)
+        os.replace(tmp_fname, fname)
+    except BaseException:
+        Path(tmp_fname).unlink(missing_ok=True)
+        raise
+
+
+def _map_npz(fname):
+    """The arrays of an uncompressed .npz file, memory-mapped."""
+    arrays = dict()
+    with zipfile.ZipFile(fname) as zf, open(fname, 'rb') as fp:
+        for info in zf.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(
+                        member, allow_pickle=False)
+                continue
+
+            # the .npy data follows the local file header of the member
+            fp.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', fp.read(4))
+            fp.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(fp)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(fp)
+            elif version == (2, 0):
+                header = np.lib.format.read_array_header_2_0(fp)
+            else:
+                header = None
+            if header is None or header[2].hasobject or \
+                    0 in header[0] or header[0] == ():
+                # small or unusual arrays are simply read
+                fp.seek(info.header_offset + 30 + name_len + extra_len)
+                arrays[name] = np.lib.format.read_array(fp,
+                                                        allow_pickle=False)
+                continue
+            shape, fortran_order, dtype = header
+            arrays[name] = np.memmap(fname, dtype=dtype, mode='r',
+                                     offset=fp.tell(), shape=shape,
+                                     order='F' if fortran_order else 'C')
+    return arrays
+
+
+def load_artifact(fname, mmap=True):
+    """Load a design.
+
+    Parameters
+    ----------
+    fname : str | Path
+        The .npz file, see :func:`save_artifact`.
+    mmap : bool
+        Whether to memory-map the arrays instead of reading them.
+
+    Returns
+    -------
+    artifact : dict
+        The stored arrays by name, the parameters as params and, if loops
+        were stored, the loops as views of loop_points.
+    """
+    if mmap:
+        artifact = _map_npz(fname)
+    else:
+        with np.load(fname, allow_pickle=False) as data:
+            artifact = {name: data[name] for name in data.files}
+
+    version = artifact.get('schema_version')
+    if version is None or int(version) != SCHEMA_VERSION:
+        raise ValueError(f'{fname} has schema version {version}, expected '
+                         f'{SCHEMA_VERSION}. Generate the design again.')
+    artifact['schema_version'] = int(version)
+    artifact['params'] = json.loads(str(artifact['params']))
+    if 'loop_points' in artifact:
+        artifact['loops'] = unpack_loops(artifact['loop_points'],
+                                         artifact['loop_offsets'])
+    return artifact
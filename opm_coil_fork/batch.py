@@ -0,0 +1,139 @@
+"""Generate several cylindrical coils at the same time in worker processes.
+
+Heavy modules (numpy, bfieldtools, mosek) are only imported inside the
+workers, after the thread limits have been set.
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS')
+
+
+def available_cores():
+    """The number of cores this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def split_cores(n_jobs, n_workers=None, n_cores=None):
+    """Split the cores between worker processes and solver threads.
+
+    Parameters
+    ----------
+    n_jobs : int
+        The number of coils to generate.
+    n_workers : int | None
+        The number of worker processes. If None, one per job as long as
+        there are cores for it.
+    n_cores : int | None
+        The number of cores to use. If None, all available cores.
+
+    Returns
+    -------
+    n_workers : int
+        The number of worker processes.
+    n_threads : int
+        The number of solver threads per worker.
+    """
+    if n_cores is None:
+        n_cores = available_cores()
+    if n_workers is None:
+        n_workers = min(n_jobs, n_cores)
+    n_workers = max(1, n_workers)
+    n_threads = max(1, n_cores // n_workers)
+    return n_workers, n_threads
+
+
+def _init_worker(n_threads):
+    # must run before numpy is imported in the worker
+    for var in _THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+
+
+def _generate(spec, n_threads):
+    import numpy as np
+    from new_coil_generation import generate_windings
+
+    # the workers would all write the same windings_<coil_type>.npz, a spec
+    # can still give its own file as save, and its own number of threads
+    spec = dict(dict(save=False), **spec)
+    spec.setdefault('num_threads', n_threads)
+    windings = generate_windings(**spec)
+    vertices, faces, s, loops, target_points, target_field, diameter = windings
+    if s is None:
+        return windings, None
+
+    # StreamFunction loses its MeshConductor when pickled, send it along.
+    # The coupling matrices are not needed anymore and only bloat the transfer.
+    mesh_conductor = s.mesh_conductor
+    for coupling in (mesh_conductor.B_coupling, mesh_conductor.U_coupling,
+                     mesh_conductor.A_coupling):
+        coupling.reset()
+    windings = (vertices, faces, np.asarray(s), loops,
+                target_points, target_field, diameter)
+    return windings, mesh_conductor
+
+
+def _rebuild(windings, mesh_conductor):
+    if mesh_conductor is None:
+        return windings
+
+    from bfieldtools.mesh_conductor import StreamFunction
+
+    vertices, faces, s, loops, target_points, target_field, diameter = windings
+    s = StreamFunction(s, mesh_conductor)
+    return vertices, faces, s, loops, target_points, target_field, diameter
+
+
+def generate_windings_batch(specs, n_workers=None, n_cores=None):
+    """Run generate_windings for several coils in parallel.
+
+    Parameters
+    ----------
+    specs : list of str | list of dict
+        The coils to generate. Either coil types ('X', 'Y', 'Z') or dicts
+        of keyword arguments for generate_windings, e.g.
+        ``{'coil_type': 'Y', 'cache': False}``. The designs are not saved,
+        unless a spec gives its own file as save.
+    n_workers : int | None
+        The number of worker processes, see :func:`split_cores`.
+    n_cores : int | None
+        The number of cores to use, see :func:`split_cores`.
+
+    Returns
+    -------
+    windings : list of tuple
+        For each spec, the (vertices, faces, s, loops, target_points,
+        target_field, diameter) tuple returned by generate_windings, which
+        can be passed to ``CylindricalCoil(coil_type, windings=...)``.
+    """
+    specs = [{'coil_type': spec} if isinstance(spec, str) else dict(spec)
+             for spec in specs]
+    n_workers, n_threads = split_cores(len(specs), n_workers, n_cores)
+
+    # spawn so that the thread limits apply to freshly imported libraries
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx,
+                             initializer=_init_worker,
+                             initargs=(n_threads,)) as pool:
+        futures = [pool.submit(_generate, spec, n_threads) for spec in specs]
+        return [_rebuild(*future.result()) for future in futures]
+
+
+if __name__ == '__main__':
+    from new_coil_generation import CylindricalCoil
+
+    coil_types = ['X', 'Y', 'Z']
+    all_windings = generate_windings_batch(coil_types)
+
+    for coil_type, windings in zip(coil_types, all_windings):
+        if windings[2] is None:
+            print(f"Failed to generate {coil_type} windings.")
+            continue
+        coil = CylindricalCoil(coil_type, windings=windings)
+        print(f"{coil_type}: length {coil.length:.2f} m, "
+              f"resistance {coil.resistance:.2f} ohm")
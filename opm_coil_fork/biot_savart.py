@@ -0,0 +1,142 @@
+"""Biot-Savart field of straight line segments.
+
+All loops are handled as one array of segments, shape (n_segments, 2, 3),
+holding the start and end point of each segment. The field is evaluated
+in blocks of points x segments so that memory use does not grow with the
+problem size, and the blocks of points are spread across threads.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batch import available_cores
+
+DEFAULT_CHUNK_SIZE = 2 ** 18   # point-segment pairs per block
+
+
+def loop_segments(loops, close=True):
+    """Segments of polylines.
+
+    Parameters
+    ----------
+    loops : list of array, shape (n_vertices, 3)
+        The polylines.
+    close : bool
+        Whether to connect the last vertex of each polyline back to the
+        first one, unless it already is, like LineConductor does.
+
+    Returns
+    -------
+    segments : array, shape (n_segments, 2, 3)
+        The start and end points of the segments.
+    """
+    segments = list()
+    for loop in loops:
+        loop = np.asarray(loop, dtype=float)
+        if close and not np.all(loop[0] == loop[-1]):
+            loop = np.concatenate((loop, loop[:1]))
+        segments.append(np.stack((loop[:-1], loop[1:]), axis=1))
+    if not segments:
+        return np.zeros((0, 2, 3))
+    return np.concatenate(segments)
+
+
+def conductor_segments(line_conductor):
+    """Segments of a bfieldtools LineConductor, in the same order."""
+    return np.concatenate(
+        [loop_segments([line_conductor.vertices[entity.points]], close=False)
+         for entity in line_conductor.entities] or [np.zeros((0, 2, 3))])
+
+
+def _field_block(starts, ends, points):
+    # Hanson & Hirshman, https://doi.org/10.1063/1.1507589, as in
+    # bfieldtools.line_magnetics.magnetic_field. The coordinates are kept
+    # in separate (n_points, n_segments) arrays, which is much faster than
+    # operating on a trailing axis of length 3.
+    x1, y1, z1 = (points[:, i:i + 1] - starts[i] for i in range(3))
+    x2, y2, z2 = (points[:, i:i + 1] - ends[i] for i in range(3))
+    d1 = np.sqrt(x1 * x1 + y1 * y1 + z1 * z1)
+    d2 = np.sqrt(x2 * x2 + y2 * y2 + z2 * z2)
+    d1d2 = d1 * d2
+    scale = (d1 + d2) / (d1d2 * (d1d2 + x1 * x2 + y1 * y2 + z1 * z2))
+    return np.stack((((y1 * z2 - z1 * y2) * scale).sum(axis=1),
+                     ((z1 * x2 - x1 * z2) * scale).sum(axis=1),
+                     ((x1 * y2 - y1 * x2) * scale).sum(axis=1)), axis=1)
+
+
+def default_n_jobs():
+    """The number of threads for magnetic_field.
+
+    The cores this process may run on, but no more than OMP_NUM_THREADS if
+    it is set, e.g. by batch for its workers, so that workers do not
+    oversubscribe the cores between them.
+    """
+    n_jobs = available_cores()
+    try:
+        n_jobs = min(n_jobs, int(os.environ['OMP_NUM_THREADS']))
+    except (KeyError, ValueError):
+        pass
+    return max(n_jobs, 1)
+
+
+def magnetic_field(segments, points, chunk_size=DEFAULT_CHUNK_SIZE,
+                   n_jobs=None, dtype=np.float64):
+    """Magnetic field of a unit current through line segments.
+
+    Gives the same result as ``LineConductor.magnetic_field`` for the
+    segments of the conductor, see :func:`conductor_segments`.
+
+    Parameters
+    ----------
+    segments : array, shape (n_segments, 2, 3)
+        The start and end points of the segments, see :func:`loop_segments`.
+    points : array, shape (n_points, 3)
+        The points where the field is computed.
+    chunk_size : int
+        The number of point-segment pairs per block. Memory use is roughly
+        ``10 * 3 * chunk_size`` values per thread.
+    n_jobs : int | None
+        The number of threads. If None, see :func:`default_n_jobs`.
+    dtype : np.float32 | np.float64
+        The precision of the computation. The blocks are summed in float64.
+
+    Returns
+    -------
+    field : array, shape (n_points, 3)
+        The magnetic field in T.
+    """
+    segments = np.asarray(segments, dtype=dtype).reshape(-1, 2, 3)
+    points = np.asarray(points, dtype=dtype).reshape(-1, 3)
+    field = np.zeros((len(points), 3))
+    if len(segments) == 0 or len(points) == 0:
+        return field
+
+    # as many points per block as fit next to all segments, or if there are
+    # too many segments for that, one point at a time in segment blocks
+    n_points = max(1, chunk_size // len(segments))
+    n_segments = max(1, chunk_size // n_points)
+
+    # coordinate-major, so that each coordinate is a contiguous row
+    starts, ends = segments[:, 0].T.copy(), segments[:, 1].T.copy()
+
+    def compute(start):
+        block = points[start:start + n_points]
+        for seg_start in range(0, len(segments), n_segments):
+            seg_stop = seg_start + n_segments
+            field[start:start + n_points] += _field_block(
+                starts[:, seg_start:seg_stop], ends[:, seg_start:seg_stop],
+                block)
+
+    blocks = range(0, len(points), n_points)
+    if n_jobs is None:
+        n_jobs = default_n_jobs()
+    if n_jobs == 1 or len(blocks) == 1:
+        for start in blocks:
+            compute(start)
+    else:
+        # the blocks write to separate rows, numpy releases the GIL
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            list(pool.map(compute, blocks))
+    return field * 1e-7
@@ -4,29 +4,24 @@ import scipy
 from scipy.sparse import csr_matrix
 from scipy.linalg import block_diag
 
-import trimesh
-import pyvista as pv
+# trimesh, pyvista, matplotlib and bfieldtools are imported where they are
+# used, so that the helpers below load quickly, e.g. in batch workers
 
-import mosek
-
-import matplotlib.pyplot as plt
-
-from bfieldtools import sphtools
-from bfieldtools.mesh_conductor import MeshConductor
-from bfieldtools.utils import combine_meshes, load_example_mesh
-from bfieldtools.coil_optimize import optimize_streamfunctions
-from bfieldtools.contour import scalar_contour
-from bfieldtools.line_conductor import LineConductor
-
-from bfieldtools.viz import plot_3d_current_loops
-
-from metrics import homogeneity, efficiency, error
+from metrics import homogeneity, efficiency, error, evaluate
 from line_drawer import LineDrawer, get_shifted_line
 from file_io import get_loop_colors, export_to_kicad, _check_bounds
 from make_pcb import join_loops_at_cuts
+from cut_planner import plan_cuts
+from mesh_cache import mesh_conductor, B_coupling
+from contours import scalar_contour
+from solvers import get_backend
+from stream_solver import StreamFunctionSolver
 
-def mesh_to_coil(planemesh, N_suh, standoff, center_offset):
+def mesh_to_coil(planemesh, N_suh, standoff, center_offset, cache=None):
     """Create biplanar coil for optimization."""
+    import trimesh
+    from bfieldtools.mesh_conductor import MeshConductor
+    from bfieldtools.utils import combine_meshes
 
     # Create coil plane pairs
     coil_plus = trimesh.Trimesh(
@@ -42,10 +37,12 @@ def mesh_to_coil(planemesh, N_suh, standoff, center_offset):
     joined_planes = combine_meshes((coil_plus, coil_minus))
 
     # Create separate surface harmonic bases for the planes
-    coil_plus_C = MeshConductor(mesh_obj=coil_plus, basis_name='suh',
-                                N_suh=N_suh, process=False) #Change the number 300 as desired
-    coil_minus_C = MeshConductor(mesh_obj=coil_minus, basis_name='suh',
-                                 N_suh=N_suh, process=False)
+    coil_plus_C = mesh_conductor(coil_plus.vertices, coil_plus.faces,
+                                 basis_name='suh', N_suh=N_suh,
+                                 process=False, cache=cache) #Change the number 300 as desired
+    coil_minus_C = mesh_conductor(coil_minus.vertices, coil_minus.faces,
+                                  basis_name='suh', N_suh=N_suh,
+                                  process=False, cache=cache)
 
     # Combine the separate bases stacked "on top of each other"
     stacked_basis = block_diag(coil_plus_C.basis, coil_minus_C.basis)
@@ -131,6 +128,7 @@ def get_target_field(target_type, target_points, lmax=3):
 
     # Define target field
     if 'gradient' in target_type:
+        from bfieldtools import sphtools
 
         # see Brookes (2018)
         if target_type == 'gradient_x':
@@ -170,6 +168,9 @@ class BiplanarCoil:
         The number of harmonics to use in 
     standoff : float
         The distance between the mesh pairs.
+    cache : MeshCache | str | bool | None
+        On-disk cache for the plane bases and coupling matrices, see
+        mesh_cache.get_cache. False disables caching.
 
     Attributes
     ----------
@@ -187,9 +188,10 @@ class BiplanarCoil:
         The resistance of the coil in ohms.
     """
 
-    def __init__(self, planemesh, center, N_suh=50, standoff=1.6):
+    def __init__(self, planemesh, center, N_suh=50, standoff=1.6, cache=None):
 
         self._standoff = np.array([0, 0, standoff / 2])
+        self.cache = cache
         self.trace_width = None     # in mm
         self.cu_oz = None           # oz per ft^2
 
@@ -202,13 +204,14 @@ class BiplanarCoil:
         # and self.coil_ but for now we'll fuse the two
         # to not deal with deepcopy
         self.coil_ = mesh_to_coil(planemesh, N_suh,
-                                  self._standoff, center)
+                                  self._standoff, center, cache=cache)
         self.loops_ = None
 
         self.FCu = list()
         self.BCu = list()
 
-    def fit(self, target_points, target_field, abs_error=0.025):
+    def fit(self, target_points, target_field, abs_error=0.025,
+            stream_solver=None, backend=None, num_threads=8):
         """Create bfield specifications used when optimizing the coil geometry
 
         The absolute target field amplitude is not of importance,
@@ -218,21 +221,34 @@ class BiplanarCoil:
         ----------
         target_field : array, shape (n_points, 3)
             The vector target field.
+        stream_solver : StreamFunctionSolver | None
+            Solver shared between fits (e.g. when sweeping the standoff)
+            to warm start from the previous solution and reuse still
+            valid factorizations. If None, the problem is solved cold.
+        backend : SolverBackend | str | None
+            The solver backend when no stream_solver is given, see
+            solvers.get_backend.
+        num_threads : int
+            The number of solver threads if backend is not a SolverBackend.
         """
         target_spec = {
-            "coupling": self.coil_.B_coupling(target_points),
+            "coupling": B_coupling(self.coil_, target_points,
+                                   cache=self.cache),
             "abs_error": abs_error,
             "target": target_field,
         }
 
         bfield_specification = [target_spec]
 
-        self.coil_.s, prob = optimize_streamfunctions(
+        if stream_solver is None:
+            stream_solver = StreamFunctionSolver(
+                get_backend(backend, num_threads=num_threads),
+                warm_start=False)
+
+        self.coil_.s, prob = stream_solver.solve(
             self.coil_,
             bfield_specification,
             objective='minimum_ohmic_power',
-            solver="MOSEK",
-            solver_opts={"mosek_params": {mosek.iparam.num_threads: 8}},
         )
 
     def discretize(self, N_contours=40, trace_width=4., cu_oz=4.):
@@ -249,6 +265,8 @@ class BiplanarCoil:
         """
         self.trace_width = trace_width
         self.cu_oz = cu_oz
+        from bfieldtools.line_conductor import LineConductor
+
         self.loops_ = scalar_contour(self.coil_.mesh, self.coil_.s.vert,
                                      N_contours=N_contours)
         self.line_conductor_ = LineConductor(loops=self.loops_)
@@ -269,38 +287,39 @@ class BiplanarCoil:
         return self.coil_.B_coupling(target_points) @ self.coil_.s
 
     def evaluate(self, target_type, target_points, target_field,
-                 target_points_z, metrics='all'):
+                 target_points_z=None, metrics='all', return_timings=False):
         """Evaluate the coil.
-        
+
+        Each field is computed once and shared between the metrics, see
+        metrics.evaluate.
+
         Parameters
         ----------
+        target_type : str
+            'dc_x' | 'dc_y' | 'dc_z' etc.
         target_points : array, (n_points, 3)
             Plot the field at the target points.
+        target_field : array, (n_points, 3)
+            The target field.
+        target_points_z : array | None
+            Unused, kept for compatibility.
+        metrics : str | list of str
+            'all' or names from metrics.METRICS.
+        return_timings : bool
+            Whether to also return the seconds spent per stage.
+
+        Returns
+        -------
+        scores : dict
+            The scores.
+        timings : dict
+            The timings, only if return_timings is True.
         """
-        if metrics == 'all':
-            metrics = ['efficiency', 'error', 'homog', 'inductance',
-                       'resistance', 'length', 'target_radius']
-
-        scores = dict()
-        for metric in metrics:
-            if metric == 'efficiency':
-                ef, _ = efficiency(self.line_conductor_, target_points,
-                                   target_points_z, target_type)
-                scores['efficiency (nT/mA)'] = ef
-            elif metric == 'error':
-                err = error(self.coil_, target_field, target_points, target_type)
-                scores['error'] = ef
-            elif metric == 'homog':
-                hmg = homogeneity(self.coil_, target_field, target_points, target_type)
-                scores['homogeneity (%)'] = hmg
-            elif metric == 'inductance':
-                scores['inductance (uH)'] = self.inductance
-            elif metric == 'resistance':
-                scores['resistance (ohm)'] = self.resistance
-            elif metric == 'length':
-                scores['length (m)'] = self.length
-            elif metric == 'target_radius':
-                scores['target radius (cm)'] = target_points[:, 2].max() * 100
+        scores, timings = evaluate(self.coil_, self.line_conductor_,
+                                   target_points, target_field, target_type,
+                                   metrics=metrics, properties=self)
+        if return_timings:
+            return scores, timings
         return scores
 
     @property
@@ -325,6 +344,8 @@ class BiplanarCoil:
         return self.coil_.s.coil_inductance(Nloops=len(self.loops_)) * 1e6
 
     def plot_field_2D(self):
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots(2, layout='constrained')
         center = np.array([0, 0, 0])
         target_points_2D, grid = get_2D_point_grid(center, n=32,
@@ -349,6 +370,9 @@ class BiplanarCoil:
         target_points : array, (n_points, 3)
             Plot the field at the target points.
         """
+        import pyvista as pv
+        from bfieldtools.viz import plot_3d_current_loops
+
         # XXX: add option to plot non-discretized stream functions
         plotter = pv.Plotter(window_size=(1500, 1700))
         plot_3d_current_loops(self.loops_, colors='auto',
@@ -373,10 +397,19 @@ class BiplanarCoil:
         #               scale_factor=0.1)
 
 
-    def make_cuts(self):
-        """Make cuts to join loops."""
-        import matplotlib.pyplot as plt
+    def make_cuts(self, interactive=True, n_angles=72):
+        """Make cuts to join loops.
 
+        Parameters
+        ----------
+        interactive : bool
+            Whether to draw the cuts with LineDrawer. If False, they are
+            placed automatically, see cut_planner.plan_cuts, and nothing
+            is plotted.
+        n_angles : int
+            The number of candidate cut directions per group of loops, if
+            not interactive.
+        """
         # Discard one panel of the pair
         loops = list()
         for loop in self.loops_:
@@ -388,6 +421,20 @@ class BiplanarCoil:
         # Discard z-coordinate
         loops = [np.array(loop)[:, [0, 1]].tolist() for loop in loops]
 
+        if not interactive:
+            line_cuts, line_cuts_shifted = plan_cuts(loops, colors,
+                                                     n_angles=n_angles)
+            for line_cut, line_cut_shifted in zip(line_cuts,
+                                                  line_cuts_shifted):
+                continuous_loop, reverse_paths, _, _, _, _ = \
+                    join_loops_at_cuts(loops, line_cut, line_cut_shifted,
+                                       colors)
+                self.FCu.append(continuous_loop)
+                self.BCu.append(reverse_paths)
+            return
+
+        import matplotlib.pyplot as plt
+
         fig = plt.figure()
         for color, loop in zip(colors, loops):
             loop_arr = np.array(loop)
@@ -446,6 +493,7 @@ class BiplanarCoil:
 if __name__ == '__main__':
 
     import matplotlib.pyplot as plt
+    from bfieldtools.utils import load_example_mesh
 
     center = np.array([0, 0, 0])
     scaling_factor = 0.16
@@ -470,8 +518,10 @@ if __name__ == '__main__':
     for n_contour in n_contours:
         coil.discretize(N_contours=n_contour, trace_width=4.,
                         cu_oz=3.)
+        # the contour levels of the same stream function are cached, only
+        # the new levels are extracted
         ef = coil.evaluate(target_type, target_points, target_field, points_z,
-                           metrics='efficiency')
+                           metrics='efficiency')['efficiency (nT/mA)']
         effs.append(ef)
         Rs.append(coil.resistance)
 
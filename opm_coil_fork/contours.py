@@ -0,0 +1,242 @@
+"""Contour loops (isolines) of a stream function on a triangle mesh.
+
+A vectorized replacement for bfieldtools.contour.scalar_contour. The edge
+crossings of all requested levels are found in one pass over the edges and
+faces, and the loops of each level are cached, so that discretizing the
+same stream function with another number of contours only extracts the
+levels that were not seen before.
+
+Closed loops are the same as those of bfieldtools. Open contours, which
+end at the mesh boundary, are not: here each one is a single polyline
+from boundary to boundary, whereas bfieldtools leaves out one of the
+boundary crossings and may split the contour into several pieces.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from mesh_cache import hash_key
+
+# ContourExtractors by (mesh, scalars), oldest dropped first
+_extractors = OrderedDict()
+MAX_CACHED_EXTRACTORS = 8
+
+
+def contour_levels(scalars, N_contours):
+    """N evenly spaced levels, leaving out the point-like min and max."""
+    return np.linspace(scalars.min(), scalars.max(), 2 * N_contours + 1)[1::2]
+
+
+class ContourExtractor:
+    """Contour loops of one scalar function on one mesh, cached per level.
+
+    Parameters
+    ----------
+    mesh : Trimesh
+        The mesh.
+    scalars : array, shape (n_verts,)
+        The scalar function (e.g. the stream function) at the vertices.
+    """
+
+    def __init__(self, mesh, scalars):
+        from bfieldtools.mesh_calculus import gradient
+
+        self.mesh = mesh
+        self.scalars = np.asarray(scalars, dtype=float)
+        self._edges = mesh.edges_unique
+        self._face_edges = mesh.faces_unique_edges
+        self._edge_vals = self.scalars[self._edges]
+        self._edge_min = self._edge_vals.min(axis=1)
+        self._edge_max = self._edge_vals.max(axis=1)
+        face_vals = self.scalars[mesh.faces]
+        self._face_min = face_vals.min(axis=1)
+        self._face_max = face_vals.max(axis=1)
+        # the loops run along the rotated gradient, e.g. the current density
+        self._gradient = gradient(self.scalars, mesh, rotated=True)
+        self._loops = dict()
+
+    def loops(self, levels, return_values=False):
+        """The contour loops at the given levels.
+
+        Parameters
+        ----------
+        levels : array-like
+            The contour levels.
+        return_values : bool
+            Whether to also return the level of each loop.
+
+        Returns
+        -------
+        loops : list of array, shape (n_points, 3)
+            The loops, level by level. Closed loops do not repeat their
+            first point.
+        values : list of float
+            The level of each loop, if return_values is True.
+        """
+        levels = [float(level) for level in np.atleast_1d(levels)]
+        missing = sorted(set(level for level in levels
+                             if level not in self._loops))
+        if missing:
+            self._extract(np.array(missing))
+
+        loops, values = list(), list()
+        for level in levels:
+            loops.extend(self._loops[level])
+            values.extend([level] * len(self._loops[level]))
+        if return_values:
+            return loops, values
+        return loops
+
+    def _extract(self, levels):
+        """Extract the loops of the sorted, not yet cached levels."""
+        n_levels = len(levels)
+        for level in levels:
+            self._loops[float(level)] = list()
+
+        # every edge crosses a contiguous range of the sorted levels,
+        # one node per (edge, level) crossing
+        lo = np.searchsorted(levels, self._edge_min, side='left')
+        hi = np.searchsorted(levels, self._edge_max, side='right')
+        counts = hi - lo
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        n_nodes = offsets[-1]
+        if n_nodes == 0:
+            return
+        node_edge = np.repeat(np.arange(len(counts)), counts)
+        node_level = (np.arange(n_nodes) - np.repeat(offsets[:-1], counts) +
+                      np.repeat(lo, counts))
+
+        # linear interpolation along the edges
+        vals = self._edge_vals[node_edge]
+        c = levels[node_level]
+        w0 = (c - vals[:, 1]) / (vals[:, 0] - vals[:, 1])
+        w1 = (vals[:, 0] - c) / (vals[:, 0] - vals[:, 1])
+        verts = self.mesh.vertices[self._edges[node_edge]]
+        points = verts[:, 0] * w0[:, None] + verts[:, 1] * w1[:, None]
+
+        # likewise the faces, each (face, level) pair links the two
+        # crossings on its edges
+        face_lo = np.searchsorted(levels, self._face_min, side='left')
+        face_hi = np.searchsorted(levels, self._face_max, side='right')
+        face_counts = face_hi - face_lo
+        n_pairs = face_counts.sum()
+        pair_face = np.repeat(np.arange(len(face_counts)), face_counts)
+        pair_level = (np.arange(n_pairs) -
+                      np.repeat(np.cumsum(face_counts) - face_counts,
+                                face_counts) +
+                      np.repeat(face_lo, face_counts))
+        pair_edges = self._face_edges[pair_face]
+        crosses = ((lo[pair_edges] <= pair_level[:, None]) &
+                   (pair_level[:, None] < hi[pair_edges]))
+        keep = crosses.sum(axis=1) >= 2
+        # the first two crossing edges of the face, in face order
+        first_two = np.argsort(~crosses[keep], axis=1, kind='stable')[:, :2]
+        link_edges = np.take_along_axis(pair_edges[keep], first_two, axis=1)
+        link_nodes = (offsets[link_edges] +
+                      (pair_level[keep][:, None] - lo[link_edges]))
+        link_faces = pair_face[keep]
+
+        # up to two neighbours per node
+        ends = link_nodes.T.ravel()
+        others = link_nodes[:, ::-1].T.ravel()
+        faces = np.tile(link_faces, 2)
+        order = np.argsort(ends, kind='stable')
+        ends, others, faces = ends[order], others[order], faces[order]
+        group_start = np.searchsorted(ends, ends, side='left')
+        slot = np.arange(len(ends)) - group_start
+        ok = slot < 2
+        neighbours = np.full((n_nodes, 2), -1)
+        neighbour_faces = np.full((n_nodes, 2), -1)
+        neighbours[ends[ok], slot[ok]] = others[ok]
+        neighbour_faces[ends[ok], slot[ok]] = faces[ok]
+
+        # open contours (ending at the mesh boundary) are walked from one of
+        # their ends, then the closed ones
+        degree = (neighbours >= 0).sum(axis=1)
+        starts = np.concatenate((np.flatnonzero(degree == 1),
+                                 np.flatnonzero(degree == 2)))
+        visited = np.zeros(n_nodes, dtype=bool)
+        neighbours, neighbour_faces = neighbours.tolist(), \
+            neighbour_faces.tolist()
+        for start in starts:
+            if visited[start]:
+                continue
+            path = [start]
+            visited[start] = True
+            prev, node = -1, start
+            while True:
+                nxt = [n for n in neighbours[node] if n >= 0 and n != prev
+                       and not visited[n]]
+                if not nxt:
+                    break
+                prev, node = node, nxt[0]
+                visited[node] = True
+                path.append(node)
+            if len(path) < 2:
+                continue
+
+            # run along the rotated gradient, like scalar_contour
+            face = neighbour_faces[path[0]][neighbours[path[0]].index(path[1])]
+            if self._gradient[:, face] @ (points[path[1]] - points[path[0]]) < 0:
+                path = path[::-1]
+            level = float(levels[node_level[start]])
+            self._loops[level].append(points[path])
+
+        for level in levels:
+            if not self._loops[float(level)]:
+                print(f"No contours at f={level}")
+
+
+def get_extractor(mesh, scalars):
+    """The cached ContourExtractor of a scalar function on a mesh."""
+    scalars = np.asarray(scalars, dtype=float)
+    key = hash_key(mesh.vertices, mesh.faces, scalars)
+    if key in _extractors:
+        _extractors.move_to_end(key)
+        return _extractors[key]
+
+    extractor = ContourExtractor(mesh, scalars)
+    _extractors[key] = extractor
+    if len(_extractors) > MAX_CACHED_EXTRACTORS:
+        _extractors.popitem(last=False)
+    return extractor
+
+
+def scalar_contour(mesh, scalars, N_contours=10, contours=None,
+                   return_values=False):
+    """Contour loops of a scalar function on a mesh.
+
+    Replacement of bfieldtools.contour.scalar_contour, see
+    :class:`ContourExtractor`. The closed loops are the same, but may
+    start at a different point. Open contours, which end at the mesh
+    boundary, are returned as one polyline including both boundary
+    crossings, while bfieldtools leaves out one crossing and may return
+    an open contour in several pieces.
+
+    Parameters
+    ----------
+    mesh : Trimesh
+        The mesh.
+    scalars : array, shape (n_verts,) | StreamFunction
+        The scalar function at the vertices. For a StreamFunction, the
+        vertex-wise values are used.
+    N_contours : int
+        The number of contour levels.
+    contours : array-like | None
+        The contour levels. Overrides N_contours.
+    return_values : bool
+        Whether to also return the level of each loop.
+
+    Returns
+    -------
+    loops : list of array, shape (n_points, 3)
+        The contour loops.
+    values : list of float
+        The level of each loop, if return_values is True.
+    """
+    scalars = np.asarray(getattr(scalars, 'vert', scalars), dtype=float)
+    if contours is None:
+        contours = contour_levels(scalars, N_contours)
+    return get_extractor(mesh, scalars).loops(contours,
+                                              return_values=return_values)
@@ -0,0 +1,114 @@
+"""Automatic placement of the cuts that join loops into one winding.
+
+Instead of drawing the cuts with LineDrawer, each group of nested loops of
+one polarity gets a straight cut from outside its outermost loop to inside
+its innermost one. The cut and its shifted companion must cross every
+loop of the group exactly once and no other loop. Of the candidate angles
+around the group, the one adding the least path length is used.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from line_drawer import get_shifted_line
+from make_pcb import winding_number, get_intersection_segment, _loop_segments
+
+
+def loop_groups(loops, colors):
+    """Groups of nested loops with the same color.
+
+    Parameters
+    ----------
+    loops : list of array, shape (n_points, 2)
+        The closed loops.
+    colors : list
+        The color of each loop, e.g. from file_io.get_loop_colors.
+
+    Returns
+    -------
+    groups : list of list of int
+        The loops of each group, in the order of loops.
+    """
+    n_loops = len(loops)
+    rows, cols = list(), list()
+    for i in range(n_loops):
+        for j in range(n_loops):
+            if i != j and colors[i] == colors[j] and \
+                    winding_number(loops[i][0], loops[j]) != 0:
+                rows.append(i)
+                cols.append(j)
+    inside = csr_matrix((np.ones(len(rows)), (rows, cols)),
+                        shape=(n_loops, n_loops))
+    n_groups, labels = connected_components(inside, directed=False)
+    return [np.flatnonzero(labels == group).tolist()
+            for group in range(n_groups)]
+
+
+def _cut_cost(loops, group, line_cut, line_cut_shifted, segments):
+    """The added path length of a cut, inf if it does not join the group."""
+    loop_idxs, _, _, cut_pts = get_intersection_segment(loops, line_cut,
+                                                        segments)
+    loop_idxs2, _, _, cut_pts2 = get_intersection_segment(
+        loops, line_cut_shifted, segments)
+    # each loop of the group once, in the same order, and no other loop
+    if sorted(loop_idxs) != group or loop_idxs2 != loop_idxs:
+        return np.inf
+    # the diagonals from each loop to the next one, see join_loops_at_cuts
+    return np.linalg.norm(cut_pts[:-1] - cut_pts2[1:], axis=1).sum()
+
+
+def plan_cuts(loops, colors, n_angles=72, shift=-10., margin=10.):
+    """Pick a cut for each group of nested loops.
+
+    Parameters
+    ----------
+    loops : list of array, shape (n_points, 2)
+        The closed loops in mm, as for make_pcb.join_loops_at_cuts.
+    colors : list
+        The color of each loop, e.g. from file_io.get_loop_colors.
+    n_angles : int
+        The number of candidate cut directions per group.
+    shift : float
+        The distance of the shifted companion line in mm, see
+        line_drawer.get_shifted_line.
+    margin : float
+        How far the cut reaches past the outermost loop in mm.
+
+    Returns
+    -------
+    cuts : array, shape (n_groups, 2, 2)
+        The cuts, from outside in, like LineDrawer.get_line_cuts.
+    cuts_shifted : array, shape (n_groups, 2, 2)
+        The shifted cuts.
+    """
+    arrays = [np.asarray(loop, dtype=float)[:, :2] for loop in loops]
+    segments = _loop_segments(loops)
+    angles = np.linspace(0, 2 * np.pi, n_angles, endpoint=False)
+    directions = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+
+    cuts, cuts_shifted = list(), list()
+    for group in loop_groups(arrays, colors):
+        # the innermost loop is inside all others
+        n_outer = [sum(winding_number(arrays[idx][0], arrays[other]) != 0
+                       for other in group if other != idx) for idx in group]
+        center = arrays[group[int(np.argmax(n_outer))]].mean(axis=0)
+        reach = max(np.linalg.norm(arrays[idx] - center, axis=1).max()
+                    for idx in group) + margin
+
+        best_cost, best = np.inf, None
+        for direction in directions:
+            line_cut = np.array([center + reach * direction, center])
+            line_cut_shifted = get_shifted_line(line_cut, dist=shift)
+            cost = _cut_cost(loops, group, line_cut, line_cut_shifted,
+                             segments)
+            if cost < best_cost:
+                best_cost, best = cost, (line_cut, line_cut_shifted)
+        if best is None:
+            raise ValueError(f'No cut crosses the loops {group} once each '
+                             f'without crossing other loops, try more '
+                             f'n_angles or a smaller shift.')
+        cuts.append(best[0])
+        cuts_shifted.append(best[1])
+    return np.array(cuts).reshape(-1, 2, 2), \
+        np.array(cuts_shifted).reshape(-1, 2, 2)
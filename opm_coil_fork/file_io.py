@@ -1,8 +1,4 @@
-import trimesh
 import numpy as np
-from shapely.geometry import Polygon
-
-from bfieldtools.line_conductor import LineConductor
 
 def _check_bounds(loop, bounds):
     if min(loop[:, 0]) < bounds[0]:
@@ -72,73 +68,298 @@ def python_to_kicad(
 
     return
 
+# segments formatted and written at a time by export_to_kicad
+EXPORT_BLOCK_SIZE = 2 ** 16
+
+SEGMENT_FORMAT = ("    (segment (start %.2f %.4f) (end %.2f %.2f) (width {width}) "
+                  "(layer {layer}) (net {net}))\n")
+
+
+def _loop_blocks(loops, block_size):
+    """Consecutive loops in groups of at least block_size segments."""
+    block, n_segments = list(), 0
+    for loop in loops:
+        block.append(loop)
+        n_segments += len(loop)
+        if n_segments >= block_size:
+            yield block
+            block, n_segments = list(), 0
+    if block:
+        yield block
+
+
+def _export_segments(loops, origin, bounds=None, bounds_wholeloop=True,
+                     side=None, bound=0):
+    """The segments of the loops that are written to the board.
+
+    Returns
+    -------
+    segments : array, shape (n_segments, 4)
+        The x_start, y_start, x_end and y_end of each segment, in the order
+        of the loops.
+    """
+    # the segment from the first point of a loop is left out
+    loops = [np.asarray(loop, dtype=float) for loop in loops]
+    loops = [loop[1:, :2] for loop in loops if len(loop) > 2]
+    if not loops:
+        return np.zeros((0, 4))
+    origin = np.asarray(origin, dtype=float)[:2]
+    x_start, y_start = (np.concatenate([loop[:-1] for loop in loops]) +
+                        origin).T
+    x_end, y_end = (np.concatenate([loop[1:] for loop in loops]) + origin).T
+
+    # Prevents loops from going across the PCB when the loop is split
+    wrap = (((x_start > 0) & (x_end < 0) & (x_start - x_end > 100)) |
+            ((x_start < 0) & (x_end > 0) & (x_start - x_end < 100)))
+    x_end = np.where(wrap, x_start, x_end)
+
+    keep = np.ones(len(x_start), dtype=bool)
+    if side == 'left':
+        keep &= (x_start <= bound) & (x_end <= bound)
+    elif side == 'right':
+        keep &= (x_start >= bound) & (x_end >= bound)
+    if not bounds_wholeloop:
+        keep &= ((np.minimum(x_start, x_end) >= bounds[0]) &
+                 (np.maximum(x_start, x_end) <= bounds[1]) &
+                 (np.minimum(y_start, y_end) >= bounds[2]) &
+                 (np.maximum(y_start, y_end) <= bounds[3]))
+    return np.stack((x_start, y_start, x_end, y_end), axis=1)[keep]
+
+
+def _segment_line(layer, trace_width, net):
+    # the template of the segments of one layer, with the coordinates left
+    return SEGMENT_FORMAT.format(width='%.2f' % trace_width,
+                                 layer=str(layer).replace('%', '%%'),
+                                 net='%d' % net)
+
+
+def _format_segments(line, segments, scaling):
+    """The board text of segments, formatted all at once."""
+    if len(segments) == 0:
+        return ''
+    return (line * len(segments)) % tuple((segments * scaling).ravel().tolist())
+
+
 def export_to_kicad(pcb_fname, kicad_header_fname, loops, origin=(600, 600),
                     net=1, scaling=1, trace_width=2., bounds=None,
-                    bounds_wholeloop=True, side = None, bound = 0):
+                    bounds_wholeloop=True, side = None, bound = 0,
+                    block_size=EXPORT_BLOCK_SIZE):
+    """Write loops as the traces of a KiCad board.
 
+    The segments are selected and formatted as arrays, block_size at a
+    time, so that memory use does not grow with the number of segments.
+
+    Parameters
+    ----------
+    pcb_fname : str
+        The KiCad board file to write.
+    kicad_header_fname : str
+        The file with the board header, copied to the top of the board.
+    loops : dict of list of array, shape (n_points, 2)
+        The loops per layer, e.g. 'F.Cu' and 'B.Cu', in mm.
+    origin : tuple of (x, y)
+        The origin in mm.
+    net : int
+        The net of the traces.
+    scaling : float
+        Scaling factor applied to the segments.
+    trace_width : float
+        The trace width in mm.
+    bounds : tuple of (min_x, max_x, min_y, max_y)
+        Keep only the segments within the bounds, unless bounds_wholeloop.
+    bounds_wholeloop : bool
+        Whether the bounds were already applied to whole loops.
+    side : 'left' | 'right' | None
+        Keep only the segments on this side of bound.
+    bound : float
+        The x coordinate separating the sides.
+    block_size : int
+        The number of segments written at a time.
+    """
     print('export to kicad %s: \n' % (pcb_fname))
 
-    kicad_header = open(kicad_header_fname, 'r')
-    header = kicad_header.readlines()
+    with open(kicad_header_fname, 'r') as kicad_header:
+        header = kicad_header.read()
 
     with open(pcb_fname, "w") as file:
-        for line in header:
-            file.write(line)
+        file.write(header)
 
         for layer, layer_loops in loops.items():
-
-            for loop in layer_loops:
-                # print('loop\n')
-                for seg_idx in range(1, len(loop)-1):
-                    # print(seg_idx)
-                    seg = loop[seg_idx]
-                    x_start = seg[0] + origin[0]
-                    y_start = seg[1] + origin[1]
-
-                    seg = loop[seg_idx+1]
-                    x_end = seg[0] + origin[0]
-                    y_end = seg[1] + origin[1]
-                    
-                    ### Prevents loops from going across the PCB when the loop is split
-                    if x_start > 0 and x_end < 0 and (x_start-x_end) > 100:
-                        x_end = x_start
-                    if x_start < 0 and x_end > 0 and (x_start-x_end) < 100:
-                        x_end = x_start
-                    
-
-                    #print("[%5.2f %5.2f][%5.2f %5.2f] in [%5.2f %5.2f %5.2f %5.2f]?? \n" % (x_start, y_start,
-                    #x_end, y_end, bounds[0],bounds[1], bounds[2], bounds[3]))
-                    if side is not None:
-                        if side == 'left':
-                            if x_start > bound or x_end > bound:
-                                continue
-                        if side == 'right':
-                            if x_start < bound or x_end < bound:
-                                continue
-                    if bounds_wholeloop or _check_bounds(np.array([[x_start, y_start],[x_end, y_end], ]), bounds):
-                        file.write(
-                            "    (segment (start %.2f %.4f) (end %.2f %.2f) (width %.2f) (layer %s) (net %d))\n"
-                            % (
-                            x_start * scaling,
-                            y_start * scaling,
-                            x_end * scaling,
-                            y_end * scaling,
-                            trace_width,
-                            layer,
-                            net,
-                            )
-                        )
+            line = _segment_line(layer, trace_width, net)
+            for block in _loop_blocks(layer_loops, block_size):
+                segments = _export_segments(block, origin, bounds,
+                                            bounds_wholeloop, side, bound)
+                file.write(_format_segments(line, segments, scaling))
         file.write('\n)\n\n')
 
     print('done\n')
 
 
+def clip_segments(segments, bounds):
+    """Clip segments to a rectangle.
+
+    The parts of the segments inside the rectangle are kept, so that a
+    trace crossing the edge of a tile ends exactly on it (Liang-Barsky).
+
+    Parameters
+    ----------
+    segments : array, shape (n_segments, 4)
+        The x_start, y_start, x_end and y_end of each segment.
+    bounds : tuple of (min_x, max_x, min_y, max_y)
+        The rectangle.
+
+    Returns
+    -------
+    segments : array, shape (n_clipped, 4)
+        The clipped segments, in the same order. Segments that miss the
+        rectangle are left out.
+    """
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    x_start, y_start, x_end, y_end = segments.T
+    dx, dy = x_end - x_start, y_end - y_start
+    # the segment is inside an edge where p * t <= q
+    p = np.stack((-dx, dx, -dy, dy))
+    q = np.stack((x_start - bounds[0], bounds[1] - x_start,
+                  y_start - bounds[2], bounds[3] - y_start))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = q / p
+    t_min = np.max(np.where(p < 0, t, 0.), axis=0)
+    t_max = np.min(np.where(p > 0, t, 1.), axis=0)
+    keep = (t_min <= t_max) & ~np.any((p == 0) & (q < 0), axis=0)
+    # a segment only touching a corner or an edge from outside
+    keep &= (t_min < t_max) | ((dx == 0) & (dy == 0))
+
+    t_min, t_max = t_min[keep], t_max[keep]
+    x_start, y_start, dx, dy = x_start[keep], y_start[keep], dx[keep], dy[keep]
+    return np.stack((x_start + t_min * dx, y_start + t_min * dy,
+                     x_start + t_max * dx, y_start + t_max * dy), axis=1)
+
+
+def tile_grid(bounds, tile_size):
+    """Tiles of at most tile_size covering the bounds.
+
+    Parameters
+    ----------
+    bounds : tuple of (min_x, max_x, min_y, max_y)
+        The area to cover, in mm.
+    tile_size : float | tuple of (width, height)
+        The largest tile, e.g. the largest board the fab makes, in mm.
+
+    Returns
+    -------
+    tiles : list of tuple of (min_x, max_x, min_y, max_y)
+        The tiles, of equal size, row by row.
+    """
+    width, height = np.broadcast_to(tile_size, 2)
+    n_x = max(1, int(np.ceil((bounds[1] - bounds[0]) / width)))
+    n_y = max(1, int(np.ceil((bounds[3] - bounds[2]) / height)))
+    xs = np.linspace(bounds[0], bounds[1], n_x + 1)
+    ys = np.linspace(bounds[2], bounds[3], n_y + 1)
+    return [(xs[i], xs[i + 1], ys[j], ys[j + 1])
+            for j in range(n_y) for i in range(n_x)]
+
+
+def segment_bounds(loops, origin=(600, 600), block_size=EXPORT_BLOCK_SIZE):
+    """The extent of the segments written for the loops.
+
+    Parameters
+    ----------
+    loops : dict of list of array, shape (n_points, 2)
+        The loops per layer, e.g. 'F.Cu' and 'B.Cu', in mm.
+    origin : tuple of (x, y)
+        The origin in mm.
+    block_size : int
+        The number of segments handled at a time.
+
+    Returns
+    -------
+    bounds : tuple of (min_x, max_x, min_y, max_y)
+        The extent in mm, after adding the origin, e.g. for
+        :func:`tile_grid`.
+    """
+    # the smallest and largest x and y
+    lower, upper = np.full(2, np.inf), np.full(2, -np.inf)
+    for layer_loops in loops.values():
+        for block in _loop_blocks(layer_loops, block_size):
+            points = _export_segments(block, origin).reshape(-1, 2)
+            if len(points):
+                lower = np.minimum(lower, points.min(axis=0))
+                upper = np.maximum(upper, points.max(axis=0))
+    if not np.isfinite(lower).all():
+        raise ValueError('The loops have no segments to write.')
+    return lower[0], upper[0], lower[1], upper[1]
+
+
+def export_tiles_to_kicad(pcb_fnames, kicad_header_fname, loops, tiles,
+                          origin=(600, 600), net=1, scaling=1,
+                          trace_width=2., block_size=EXPORT_BLOCK_SIZE):
+    """Write loops as the traces of several KiCad boards, one per tile.
+
+    Unlike the side and bounds of export_to_kicad, which leave out the
+    segments crossing them, the segments are clipped at the tile edges, so
+    that the traces of neighbouring boards meet. The loops are read once,
+    block_size segments at a time, for all boards.
+
+    Parameters
+    ----------
+    pcb_fnames : list of str
+        The KiCad board file of each tile.
+    kicad_header_fname : str
+        The file with the board header, copied to the top of each board.
+    loops : dict of list of array, shape (n_points, 2)
+        The loops per layer, e.g. 'F.Cu' and 'B.Cu', in mm.
+    tiles : list of tuple of (min_x, max_x, min_y, max_y)
+        The tiles in mm, after adding the origin, see :func:`tile_grid`.
+    origin : tuple of (x, y)
+        The origin in mm.
+    net : int
+        The net of the traces.
+    scaling : float
+        Scaling factor applied to the segments.
+    trace_width : float
+        The trace width in mm.
+    block_size : int
+        The number of segments written at a time.
+    """
+    if len(pcb_fnames) != len(tiles):
+        raise ValueError(f'Got {len(pcb_fnames)} board files for '
+                         f'{len(tiles)} tiles.')
+    print(f'export to kicad {len(tiles)} tiles: \n')
+
+    with open(kicad_header_fname, 'r') as kicad_header:
+        header = kicad_header.read()
+
+    files = [open(pcb_fname, "w") for pcb_fname in pcb_fnames]
+    try:
+        for file in files:
+            file.write(header)
+
+        for layer, layer_loops in loops.items():
+            line = _segment_line(layer, trace_width, net)
+            for block in _loop_blocks(layer_loops, block_size):
+                segments = _export_segments(block, origin)
+                for file, tile in zip(files, tiles):
+                    file.write(_format_segments(
+                        line, clip_segments(segments, tile), scaling))
+
+        for file in files:
+            file.write('\n)\n\n')
+    finally:
+        for file in files:
+            file.close()
+
+    print('done\n')
+
+
 
 def loops_to_obj(fname, loops):
     """Generate circular polygon
     
     XXX: needs networkx and mapbox-earcut installed
     """
+    import trimesh
+    from shapely.geometry import Polygon
+
     tube_radius = 0.625 # radius for the resulting tubes
     n_components = 10 # number of the circle segments
     vec = np.array([0.0, 1.0]) * tube_radius
@@ -1,4 +1,3 @@
-import pyvista as pv
 import numpy as np
 
 def determine_color_auto(current_loops, origin):
@@ -41,7 +40,23 @@ def flatten_loops(loops,type):
         flattened_loops.append(flattened_points)
     return flattened_loops
 
+def unflatten_loops(flattened_loops, radii):
+    """Wrap flattened loops back onto the cylinder, see flatten_loops."""
+    loops = []
+    for flattened_points, r in zip(flattened_loops, radii):
+        theta = flattened_points[:, 0] / r + 0.1
+
+        points = np.zeros((len(flattened_points), 3))
+        points[:, 0] = r * np.cos(theta)
+        points[:, 1] = r * np.sin(theta)
+        points[:, 2] = flattened_points[:, 1]
+
+        loops.append(points)
+    return loops
+
 def plot_loops_2d(loops, colors, plotter):
+    import pyvista as pv
+
     for i, loop in enumerate(loops):
         color = colors[i]
         loop[:, 2] = 0  # Set Z-coordinate to 0 for 2D plotting
@@ -0,0 +1,112 @@
+"""Check the import time of the package and of its headless modules.
+
+Each module is imported in a fresh interpreter, the best of a few runs is
+kept, and it must stay within its budget without loading the plotting and
+solver dependencies, so that batch workers start quickly. Exits with 1 if
+a module is over budget.
+
+Example::
+
+    python import_time.py
+    python import_time.py opm_coil_fork.panels=0.8 --repeat 5
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+# loaded only when something is plotted, fitted or meshed
+HEAVY_MODULES = ('pyvista', 'pyvistaqt', 'vtk', 'matplotlib', 'mosek',
+                 'cvxpy', 'trimesh', 'bfieldtools')
+
+# the modules used without plotting or fitting, and their budget in seconds
+BUDGETS = {
+    'opm_coil_fork': 0.05,
+    'opm_coil_fork.panels': 0.5,
+    'opm_coil_fork.biot_savart': 0.3,
+    'opm_coil_fork.segment_tools': 0.3,
+    'opm_coil_fork.file_io': 0.3,
+    'opm_coil_fork.artifacts': 0.3,
+    'opm_coil_fork.biplanar_coil': 0.5,
+    'cut_planner': 0.5,
+    'new_coil_generation': 0.5,
+}
+
+_CHILD = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps(dict(seconds=seconds,
+                      heavy=[name for name in {heavy!r} if name in sys.modules])))
+"""
+
+
+def time_import(module, repeat=3):
+    """The time to import a module in a fresh interpreter.
+
+    Parameters
+    ----------
+    module : str
+        The module, e.g. opm_coil_fork.panels, or a module of the package
+        by its flat name, e.g. cut_planner.
+    repeat : int
+        The number of interpreters, the fastest one counts.
+
+    Returns
+    -------
+    seconds : float
+        The import time, without the start of the interpreter.
+    heavy : list of str
+        The heavy dependencies loaded by the import, see HEAVY_MODULES.
+    """
+    # the package and, for the flat imports of its modules, its folder
+    package_dir = Path(__file__).resolve().parent
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(package_dir.parent), str(package_dir)] +
+        [path for path in [os.environ.get('PYTHONPATH')] if path])
+    code = _CHILD.format(module=module, heavy=HEAVY_MODULES)
+
+    results = list()
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], env=env,
+                             cwd=package_dir.parent, capture_output=True,
+                             text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    best = min(results, key=lambda result: result['seconds'])
+    return best['seconds'], best['heavy']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='*', metavar='MODULE[=SECONDS]',
+                        help='the modules and their budgets, by default '
+                             'those of BUDGETS')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the number of imports of each module')
+    args = parser.parse_args(argv)
+
+    budgets = dict()
+    for spec in args.modules:
+        module, _, budget = spec.partition('=')
+        budgets[module] = float(budget) if budget else \
+            BUDGETS.get(module, 1.)
+    budgets = budgets or BUDGETS
+
+    failed = False
+    for module, budget in budgets.items():
+        seconds, heavy = time_import(module, repeat=args.repeat)
+        ok = seconds <= budget and not heavy
+        failed |= not ok
+        print(f'{"ok" if ok else "FAIL":4} {module:30} {seconds:6.3f} s '
+              f'(budget {budget:.3f} s)'
+              + (f', loads {", ".join(heavy)}' if heavy else ''))
+    return int(failed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,48 +4,78 @@
 #          Padma Sundaram <padma@nmr.mgh.harvard.edu>
 
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 def winding_number(point, polygon):
     """Courtsey ChatGPT."""
-    wn = 0
-    n = len(polygon)
+    polygon = np.asarray(polygon, dtype=float)
+    return int(_edge_windings(point, polygon,
+                              np.roll(polygon, -1, axis=0)).sum())
 
-    for i in range(n):
-        x1, y1 = polygon[i]
-        x2, y2 = polygon[(i + 1) % n]
-
-        if y1 <= point[1]:
-            if y2 > point[1] and ccw(point, (x1, y1), (x2, y2)):
-                wn += 1
-        else:
-            if y2 <= point[1] and not ccw(point, (x1, y1), (x2, y2)):
-                wn -= 1
-
-    return wn
+def _edge_windings(point, starts, ends):
+    # the contribution of each edge to the winding number of point
+    left = _ccw(point, starts, ends)
+    up = (starts[:, 1] <= point[1]) & (ends[:, 1] > point[1]) & left
+    down = (starts[:, 1] > point[1]) & (ends[:, 1] <= point[1]) & ~left
+    return up.astype(int) - down
 
 def ccw(A, B, C):
     """Are A, B, and C counterclockwise?"""
     return (C[1]-A[1])*(B[0]-A[0]) > (B[1]-A[1])*(C[0]-A[0])
 
+def _ccw(A, B, C):
+    # ccw for arrays of points, shape (..., 2)
+    A, B, C = (np.asarray(X, dtype=float) for X in (A, B, C))
+    return ((C[..., 1] - A[..., 1]) * (B[..., 0] - A[..., 0]) >
+            (B[..., 1] - A[..., 1]) * (C[..., 0] - A[..., 0]))
+
 def intersect(A, B, C, D):
     """Does AB and CD intersect?"""
     return ccw(A,C,D) != ccw(B,C,D) and ccw(A,B,C) != ccw(A,B,D)
 
-def get_intersection_segment(loops, line_cut):
-    """https://bryceboe.com/2006/10/23/line-segment-intersection-algorithm/"""
-    loop_idxs, segment_idxs = list(), list()
-    cut_segments, cut_pts = list(), list()
-    for loop_idx, loop in enumerate(loops):
-        line_segs = zip(loop, loop[1:] + [loop[0]])
-        for segment_idx, line_seg in enumerate(line_segs):
-            if intersect(line_seg[0], line_seg[1], line_cut[0], line_cut[1]):
-                cut_pts.append(get_intersection_pt(line_cut, line_seg))
-                cut_segments.append(line_seg)
-                loop_idxs.append(loop_idx)
-                segment_idxs.append(segment_idx)
-    return loop_idxs, segment_idxs, cut_segments, np.array(cut_pts)
+def _loop_segments(loops):
+    """All segments of all loops, each loop closed back to its start.
+
+    Returns
+    -------
+    starts, ends : array, shape (n_segments, 2)
+        The segments.
+    loop_idxs, segment_idxs : array of int, shape (n_segments,)
+        The loop of each segment and its index in the loop.
+    """
+    loops = [np.asarray(loop, dtype=float).reshape(-1, 2) for loop in loops]
+    lengths = [len(loop) for loop in loops]
+    if sum(lengths) == 0:
+        empty = np.zeros((0, 2))
+        return empty, empty, np.zeros(0, int), np.zeros(0, int)
+    starts = np.concatenate(loops)
+    ends = np.concatenate([np.roll(loop, -1, axis=0) for loop in loops])
+    loop_idxs = np.repeat(np.arange(len(loops)), lengths)
+    segment_idxs = np.arange(len(starts)) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths)
+    return starts, ends, loop_idxs, segment_idxs
+
+def get_intersection_segment(loops, line_cut, segments=None):
+    """https://bryceboe.com/2006/10/23/line-segment-intersection-algorithm/
+
+    All segments are tested at once. segments are the segments of the loops
+    from _loop_segments, made if None.
+    """
+    if segments is None:
+        segments = _loop_segments(loops)
+    starts, ends, loop_idxs, segment_idxs = segments
+    cut_start, cut_end = np.asarray(line_cut, dtype=float)
+    hits = np.flatnonzero(
+        (_ccw(starts, cut_start, cut_end) != _ccw(ends, cut_start, cut_end)) &
+        (_ccw(starts, ends, cut_start) != _ccw(starts, ends, cut_end)))
+    cut_pts = get_intersection_pts(line_cut, starts[hits], ends[hits])
+
+    loop_idxs = loop_idxs[hits].tolist()
+    segment_idxs = segment_idxs[hits].tolist()
+    cut_segments = [(loops[loop_idx][segment_idx],
+                     loops[loop_idx][(segment_idx + 1) % len(loops[loop_idx])])
+                    for loop_idx, segment_idx in zip(loop_idxs, segment_idxs)]
+    return loop_idxs, segment_idxs, cut_segments, cut_pts
 
 
 def get_intersection_pt(line1, line2):
@@ -65,28 +95,59 @@ def get_intersection_pt(line1, line2):
     y = det(d, ydiff) / div
     return x, y
 
-def _do_reverse(loops, loop_idxs, line_cut):
+def get_intersection_pts(line, starts, ends):
+    """Intersections of a line with many segments, see get_intersection_pt.
+
+    Returns
+    -------
+    pts : array, shape (n_segments, 2)
+        The intersection points.
+    """
+    line = np.asarray(line, dtype=float)
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    xdiff = (line[0, 0] - line[1, 0], starts[:, 0] - ends[:, 0])
+    ydiff = (line[0, 1] - line[1, 1], starts[:, 1] - ends[:, 1])
+
+    def det(a, b):
+        return a[0] * b[1] - a[1] * b[0]
+
+    div = det(xdiff, ydiff)
+    if np.any(div == 0):
+       raise Exception('lines do not intersect')
+
+    d = (det(line[0], line[1]), det(starts.T, ends.T))
+    x = det(d, xdiff) / div
+    y = det(d, ydiff) / div
+    return np.stack((x, y), axis=-1)
+
+def _do_reverse(loops, loop_idxs, line_cut, segments=None):
     """If first point is inside any of the loops, reverse it so it is outside."""
-    reverse = False
-    for loop_idx in loop_idxs:
-        if winding_number(line_cut[0], loops[loop_idx]) != 0:
-            return True
-    return reverse
+    if segments is None:
+        segments = _loop_segments(loops)
+    starts, ends, seg_loop_idxs, _ = segments
+    # the winding numbers of the cut loops, all at once
+    cut = np.isin(seg_loop_idxs, np.unique(loop_idxs))
+    windings = np.bincount(seg_loop_idxs[cut],
+                           _edge_windings(line_cut[0], starts[cut], ends[cut]),
+                           minlength=len(loops))
+    return bool(np.any(windings != 0))
 
 def join_loops_at_cuts(loops, line_cut, line_cut_shifted, colors):
     """Join loops into one continuous path"""
 
-    # join loops at cut
+    # join loops at cut, the segments of all loops are tested at once
+    loop_segments = _loop_segments(loops)
     loop_idxs, segment_idxs, segments, cut_pts = get_intersection_segment(
-        loops, line_cut)
+        loops, line_cut, loop_segments)
 
     # force line cuts to be "out to in".
-    if _do_reverse(loops, loop_idxs, line_cut):
+    if _do_reverse(loops, loop_idxs, line_cut, loop_segments):
         line_cut_shifted, line_cut = line_cut[::-1], line_cut_shifted[::-1]
         loop_idxs, segment_idxs, segments, cut_pts = get_intersection_segment(
-            loops, line_cut)
+            loops, line_cut, loop_segments)
     loop_idxs2, segment_idxs2, segments2, cut_pts2 = get_intersection_segment(
-        loops, line_cut_shifted)
+        loops, line_cut_shifted, loop_segments)
 
     assert len(loop_idxs) == len(loop_idxs2)
 
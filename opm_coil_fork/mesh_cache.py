@@ -0,0 +1,334 @@
+"""Persistent cache for MeshConductor bases, coupling matrices and PCB
+chains."""
+
+import os
+import hashlib
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+DEFAULT_CACHE_DIR = Path(os.environ.get('SMEG_CACHE_DIR',
+                                        Path.home() / '.cache' / 'smeg'))
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3    # bytes
+
+_default_cache = None
+
+
+def hash_key(*items):
+    """Content hash of arrays and parameters.
+
+    Parameters
+    ----------
+    *items : array-like | str | float | int
+        Arrays are hashed by dtype, shape and raw bytes, everything else
+        by its repr.
+
+    Returns
+    -------
+    key : str
+        The hex digest.
+    """
+    h = hashlib.sha256()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            arr = np.ascontiguousarray(item)
+            h.update(f'{arr.dtype.str}{arr.shape}'.encode())
+            h.update(arr.tobytes())
+        else:
+            h.update(repr(item).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def file_hash(fname, block_size=2 ** 20):
+    """Content hash of a file.
+
+    Parameters
+    ----------
+    fname : str | Path
+        The file.
+    block_size : int
+        The number of bytes read at a time.
+
+    Returns
+    -------
+    digest : str
+        The hex digest.
+    """
+    h = hashlib.sha256()
+    with open(fname, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class MeshCache:
+    """Directory of .npz entries with a size cap and LRU eviction.
+
+    Parameters
+    ----------
+    cache_dir : str | Path | None
+        Where the entries are stored. Defaults to ``$SMEG_CACHE_DIR`` or
+        ``~/.cache/smeg``.
+    max_size : int
+        The maximum total size of the cache directory in bytes. The least
+        recently used entries are removed once it is exceeded.
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR)
+        self.max_size = max_size
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key):
+        return self.cache_dir / f'{key}.npz'
+
+    def __contains__(self, key):
+        return self._path(key).exists()
+
+    def load(self, key):
+        """Load an entry.
+
+        Parameters
+        ----------
+        key : str
+            The entry key, see :func:`hash_key`.
+
+        Returns
+        -------
+        arrays : dict of array | None
+            The stored arrays or None if there is no (readable) entry.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # half-written or corrupt entry
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)  # mark as recently used
+        return arrays
+
+    def save(self, key, **arrays):
+        """Store arrays under key and evict old entries if needed."""
+        # write to a temporary file first so that concurrent workers
+        # never see a partial entry
+        fd, tmp_fname = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                np.savez(fp, **arrays)
+            os.replace(tmp_fname, self._path(key))
+        except BaseException:
+            Path(tmp_fname).unlink(missing_ok=True)
+            raise
+        self.evict()
+
+    def _entries(self):
+        entries = list()
+        for path in self.cache_dir.glob('*.npz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:   # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @property
+    def size(self):
+        """The total size of the cache in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_size=None):
+        """Remove least recently used entries until under max_size."""
+        if max_size is None:
+            max_size = self.max_size
+        entries = sorted(self._entries(), key=lambda entry: entry[0])
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_size:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        """Remove all entries."""
+        self.evict(max_size=0)
+
+
+def get_cache(cache=None):
+    """Resolve the cache argument used throughout.
+
+    Parameters
+    ----------
+    cache : MeshCache | str | Path | bool | None
+        None or True uses the default cache, False disables caching and
+        a path creates a cache in that directory.
+
+    Returns
+    -------
+    cache : MeshCache | None
+        The cache or None if caching is disabled.
+    """
+    global _default_cache
+
+    if cache is False:
+        return None
+    if isinstance(cache, MeshCache):
+        return cache
+    if cache is None or cache is True:
+        if _default_cache is None:
+            _default_cache = MeshCache()
+        return _default_cache
+    return MeshCache(cache)
+
+
+def _pack(name, mat):
+    if issparse(mat):
+        mat = csr_matrix(mat)
+        return {f'{name}_data': mat.data, f'{name}_indices': mat.indices,
+                f'{name}_indptr': mat.indptr,
+                f'{name}_shape': np.array(mat.shape)}
+    return {name: np.asarray(mat)}
+
+
+def _unpack(name, arrays):
+    if name in arrays:
+        return arrays[name]
+    return csr_matrix((arrays[f'{name}_data'], arrays[f'{name}_indices'],
+                       arrays[f'{name}_indptr']),
+                      shape=tuple(arrays[f'{name}_shape']))
+
+
+def _restore_suh_basis(coil, basis, eigenvals):
+    """Set the SuhBasis of a conductor from its cached eigenvectors."""
+    from bfieldtools.mesh_conductor import MeshConductor
+    from bfieldtools.suhtools import SuhBasis
+
+    # the attributes SuhBasis.__init__ sets, without the eigendecomposition.
+    # Like there, the harmonics have their own conductor in the inner basis
+    conductor = MeshConductor(mesh_obj=coil.mesh, resistance_full_rank=False)
+    suh_basis = SuhBasis.__new__(SuhBasis)
+    suh_basis.bc = 'dirichlet'
+    suh_basis.mesh_conductor = conductor
+    suh_basis.mesh = conductor.mesh
+    suh_basis.magnetic = False
+    suh_basis.solver_sparse = True
+    suh_basis._max_Nc = conductor.basis.shape[1] - \
+        int(conductor.mesh.is_watertight)
+    suh_basis.Nc = basis.shape[1]
+    suh_basis.inner_vertices = conductor.inner_vertices
+    suh_basis.holes = conductor.holes
+    suh_basis.inner2vert = conductor.inner2vert
+    suh_basis.basis = basis
+    suh_basis.eigenvals = eigenvals
+    coil.suh_basis = suh_basis
+
+
+def mesh_conductor(verts, tris, basis_name='suh', N_suh=100, cache=None,
+                   **kwargs):
+    """Create a MeshConductor, reusing a cached stream function basis.
+
+    The basis, inner2vert and vert2inner matrices and the surface
+    harmonics with their eigenvalues are keyed by the mesh vertices/faces,
+    the basis name, N_suh and the remaining MeshConductor options. A
+    conductor from the cache has the same suh_basis as a new one.
+
+    Parameters
+    ----------
+    verts : array, shape (n_verts, 3)
+        The mesh vertices.
+    tris : array, shape (n_faces, 3)
+        The mesh faces.
+    basis_name : str
+        'suh', 'inner' or 'vertex'.
+    N_suh : int
+        The number of surface harmonics.
+    cache : MeshCache | str | bool | None
+        See :func:`get_cache`.
+    **kwargs : dict
+        Passed to MeshConductor, e.g. fix_normals or process.
+
+    Returns
+    -------
+    coil : MeshConductor
+        The mesh conductor with the basis set.
+    """
+    from bfieldtools.mesh_conductor import MeshConductor
+
+    verts = np.asarray(verts, dtype=float)
+    tris = np.asarray(tris)
+    cache = get_cache(cache)
+    if cache is None or basis_name != 'suh':
+        # only the harmonic basis is worth caching
+        return MeshConductor(verts=verts, tris=tris, basis_name=basis_name,
+                             N_suh=N_suh, **kwargs)
+
+    key = hash_key('basis', verts, tris, basis_name, N_suh,
+                   sorted(kwargs.items()))
+    arrays = cache.load(key)
+    # entries from before the surface harmonics were stored are rebuilt
+    if arrays is None or 'suh_eigenvals' not in arrays:
+        coil = MeshConductor(verts=verts, tris=tris, basis_name=basis_name,
+                             N_suh=N_suh, **kwargs)
+        cache.save(key, **_pack('basis', coil.basis),
+                   **_pack('inner2vert', coil.inner2vert),
+                   **_pack('vert2inner', coil.vert2inner),
+                   suh_basis=coil.suh_basis.basis,
+                   suh_eigenvals=coil.suh_basis.eigenvals)
+        return coil
+
+    # "inner" is cheap to set up, overwrite it with the cached basis
+    coil = MeshConductor(verts=verts, tris=tris, basis_name='inner',
+                         N_suh=N_suh, **kwargs)
+    coil.basis = _unpack('basis', arrays)
+    coil.inner2vert = _unpack('inner2vert', arrays)
+    coil.vert2inner = _unpack('vert2inner', arrays)
+    coil.basis_name = basis_name
+    _restore_suh_basis(coil, arrays['suh_basis'], arrays['suh_eigenvals'])
+    return coil
+
+
+def B_coupling(coil, target_points, cache=None):
+    """Magnetic field coupling of a coil, reusing a cached matrix.
+
+    The vertex-wise coupling matrix only depends on the mesh and the
+    target points, so it is shared between bases. It is loaded into the
+    coil's own coupling bookkeeping before being projected onto the
+    current basis.
+
+    Parameters
+    ----------
+    coil : MeshConductor
+        The mesh conductor.
+    target_points : array, shape (n_points, 3)
+        The points where the field is computed.
+    cache : MeshCache | str | bool | None
+        See :func:`get_cache`.
+
+    Returns
+    -------
+    coupling : array, shape (n_points, 3, n_basis)
+        The same as ``coil.B_coupling(target_points)``.
+    """
+    target_points = np.asarray(target_points, dtype=float)
+    cache = get_cache(cache)
+    if cache is None:
+        return coil.B_coupling(target_points)
+
+    key = hash_key('B_coupling', coil.mesh.vertices, coil.mesh.faces,
+                   target_points)
+    arrays = cache.load(key)
+    if arrays is None:
+        coupling = coil.B_coupling(target_points)
+        cache.save(key, matrix=coil.B_coupling.matrix,
+                   points=coil.B_coupling.points)
+        return coupling
+
+    coil.B_coupling.matrix = arrays['matrix']
+    coil.B_coupling.points = arrays['points']
+    return coil.B_coupling(target_points)
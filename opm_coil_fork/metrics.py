@@ -3,26 +3,63 @@
 # Authors: Mainak Jas <mjas@mgh.harvard.edu>
 #          Padma Sundaram <padma@nmr.mgh.harvard.edu>
 
+import time
+
 import numpy as np
 
-def _percent_error(coil, target_field, target_points, target_type):
-    field = coil.B_coupling(target_points) @ coil.s
+from biot_savart import magnetic_field, conductor_segments
+
+# All metrics, in the order they are reported
+METRICS = ['efficiency', 'error', 'homog', 'inductance', 'resistance',
+           'length', 'target_radius']
+
+# The field each metric is derived from: the stream function through the
+# coupling matrix or the discretized loops through Biot-Savart
+METRIC_FIELDS = {'efficiency': 'loop_field', 'error': 'coupling_field',
+                 'homog': 'coupling_field'}
+
+def coupling_field(coil, target_points):
+    """Field of the idealized (stream function) currents."""
+    return coil.B_coupling(target_points) @ coil.s
+
+def loop_field(current_loops, target_points):
+    """Field of a unit current in the discretized loops."""
+    if not isinstance(current_loops, np.ndarray):
+        current_loops = conductor_segments(current_loops)
+    return magnetic_field(current_loops, target_points)
+
+def _percent_error(coil, target_field, target_points, target_type,
+                   field=None):
+    if field is None:
+        field = coupling_field(coil, target_points)
     ax = {'x': 0, 'y': 1, 'z': 2}[target_type.split('_')[1]]
     return np.abs((field[:, ax] - target_field[:, ax]) / target_field[:, ax])
 
 def homogeneity(coil, target_field, target_points, target_type,
-                allowed_error=0.05):
-    """Compute homogeneity percentage with discretized current loops."""
-    err = _percent_error(coil, target_field, target_points, target_type)
+                allowed_error=0.05, field=None):
+    """Compute homogeneity percentage with discretized current loops.
+
+    field : array, shape (n_points, 3) | None
+        The precomputed coupling_field, computed if None.
+    """
+    err = _percent_error(coil, target_field, target_points, target_type,
+                         field=field)
     count = np.sum(err <= allowed_error)
     return count / target_field.shape[0] * 100
 
-def efficiency(current_loops, target_points, target_type):
-    """Compute efficiency with discretized current loops."""
+def efficiency(current_loops, target_points, target_type, field=None):
+    """Compute efficiency with discretized current loops.
+
+    current_loops : LineConductor | array, shape (n_segments, 2, 3)
+        The loops, or their segments, see biot_savart.loop_segments.
+    field : array, shape (n_points, 3) | None
+        The precomputed loop_field, computed if None.
+    """
     ax = {'x': 0, 'y': 1, 'z': 2}[target_type.split('_')[1]]
-    
+
     if 'dc' in target_type:
-        field = current_loops.magnetic_field(points=target_points)
+        if field is None:
+            field = loop_field(current_loops, target_points)
         # print(field * 1e-3 * 1e9)
         efficiency = np.mean(field * 1e-3 * 1e9, axis=0)[ax]
         unit = 'nT / mA'
@@ -36,7 +73,7 @@ def efficiency(current_loops, target_points, target_type):
     
     return efficiency, unit
 
-def error(coil, target_field, target_points, target_type):
+def error(coil, target_field, target_points, target_type, field=None):
     """Compute error percentage with idealized current loops.
 
     coil :
@@ -45,6 +82,106 @@ def error(coil, target_field, target_points, target_type):
         The target field
     target_type : str
         'gradient_x' | 'gradient_y' | 'dc_x' | 'dc_y' etc.
+    field : array, shape (n_points, 3) | None
+        The precomputed coupling_field, computed if None.
     """
     return np.mean(
-        _percent_error(coil, target_field, target_points, target_type)) * 100
+        _percent_error(coil, target_field, target_points, target_type,
+                       field=field)) * 100
+
+def evaluation_plan(metrics='all'):
+    """The fields needed for the metrics, each listed once.
+
+    Parameters
+    ----------
+    metrics : str | list of str
+        'all', a name from METRICS or a list of them.
+
+    Returns
+    -------
+    metrics : list of str
+        The metrics.
+    fields : list of str
+        The fields to compute, 'coupling_field' and/or 'loop_field'.
+    """
+    if metrics == 'all':
+        metrics = METRICS
+    elif isinstance(metrics, str):
+        metrics = [metrics]
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f'Unknown metrics {sorted(unknown)}. Must be in '
+                         f'{METRICS}.')
+    fields = list()
+    for metric in metrics:
+        field = METRIC_FIELDS.get(metric)
+        if field is not None and field not in fields:
+            fields.append(field)
+    return list(metrics), fields
+
+def evaluate(coil, current_loops, target_points, target_field, target_type,
+             metrics='all', properties=None):
+    """Compute several metrics, computing each field only once.
+
+    Parameters
+    ----------
+    coil : MeshConductor
+        The mesh conductor with the stream function in ``coil.s``.
+    current_loops : LineConductor | array, shape (n_segments, 2, 3)
+        The discretized loops.
+    target_points : array, shape (n_points, 3)
+        The points where the metrics are computed.
+    target_field : array, shape (n_points, 3)
+        The target field.
+    target_type : str
+        'dc_x' | 'dc_y' | 'dc_z' etc.
+    metrics : str | list of str
+        'all', a name from METRICS or a list of them.
+    properties : object | None
+        Object with the inductance, resistance and length attributes, only
+        read for the requested metrics.
+
+    Returns
+    -------
+    scores : dict
+        The scores.
+    timings : dict
+        The seconds spent per stage, i.e. per field and on the scores.
+    """
+    metrics, fields = evaluation_plan(metrics)
+
+    timings = dict()
+    computed = dict()
+    for name in fields:
+        t0 = time.perf_counter()
+        if name == 'coupling_field':
+            computed[name] = coupling_field(coil, target_points)
+        else:
+            computed[name] = loop_field(current_loops, target_points)
+        timings[name] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    scores = dict()
+    for metric in metrics:
+        if metric == 'efficiency':
+            scores['efficiency (nT/mA)'], _ = efficiency(
+                current_loops, target_points, target_type,
+                field=computed['loop_field'])
+        elif metric == 'error':
+            scores['error'] = error(coil, target_field, target_points,
+                                    target_type,
+                                    field=computed['coupling_field'])
+        elif metric == 'homog':
+            scores['homogeneity (%)'] = homogeneity(
+                coil, target_field, target_points, target_type,
+                field=computed['coupling_field'])
+        elif metric == 'inductance':
+            scores['inductance (uH)'] = properties.inductance
+        elif metric == 'resistance':
+            scores['resistance (ohm)'] = properties.resistance
+        elif metric == 'length':
+            scores['length (m)'] = properties.length
+        elif metric == 'target_radius':
+            scores['target radius (cm)'] = target_points[:, 2].max() * 100
+    timings['scores'] = time.perf_counter() - t0
+    return scores, timings
@@ -1,21 +1,21 @@
+import os
 import numpy as np
-import scipy
-import trimesh
-import pyvista as pv
-import mosek
 import math
-import matplotlib.pyplot as plt
-from bfieldtools.mesh_conductor import MeshConductor
-from bfieldtools.coil_optimize import optimize_streamfunctions
-from bfieldtools.contour import scalar_contour
-from bfieldtools.line_conductor import LineConductor
-from metrics import homogeneity, efficiency, error
+from metrics import (homogeneity, efficiency, error, evaluate,
+                     evaluation_plan)
 from line_drawer import LineDrawer, get_shifted_line
-from file_io import get_loop_colors, export_to_kicad, _check_bounds
+from file_io import (get_loop_colors, export_to_kicad, export_tiles_to_kicad,
+                     tile_grid, segment_bounds, _check_bounds)
 from make_pcb import join_loops_at_cuts
-import pickle
-import pkg_resources
-from flatten_windings import flatten_loops, plot_loops_2d, determine_color_auto
+from mesh_cache import mesh_conductor, B_coupling
+from contours import scalar_contour
+from biot_savart import magnetic_field, conductor_segments
+from artifacts import save_artifact, load_artifact
+from simplify import coalesce_masks, snap_to_coalesced, field_deviation
+from solvers import get_backend
+from stream_solver import StreamFunctionSolver
+from flatten_windings import (flatten_loops, unflatten_loops, plot_loops_2d,
+                              determine_color_auto)
 
 """
 This script is written to generate windings specific for the Single Layer MSR
@@ -26,27 +26,65 @@ transformed to be a planar coil for PCB fabrication.
 """
 
 
-def generate_windings(coil_type, new_diamater=0.96/2, new_height_scale=0.50/2, n_contours=3):
+# The decided scaling and number of contours for each coil type
+COIL_DEFAULTS = {
+    'X': {'new_diameter': 1.0, 'n_contours': 3},
+    'Y': {'new_diameter': 0.98, 'n_contours': 11},
+    'Z': {'new_diameter': 0.96, 'n_contours': 3},
+}
+
+
+def generate_windings(coil_type, new_diameter=None, new_height_scale=0.50/2, n_contours=None,
+                      N_suh=400, sidelength=0.4, n=9, abs_error=0.01,
+                      cache=None, num_threads=8, save=True, stream_solver=None,
+                      backend=None):
     """
     Generate windings for the coil.
 
     Parameters
     ----------
-    new_radius_scale : float, optional
-        The multiplier for the mesh's radius, by default 0.96/2
+    new_diameter : float, optional
+        The multiplier for the mesh's radius, by default the COIL_DEFAULTS
+        value for the coil type
     new_height_scale : float, optional
         The multiplier for the mesh's height, by default 0.50/2
     n_contours : int, optional
-        How many contours the windings should take, by default 3
+        How many contours the windings should take, by default the
+        COIL_DEFAULTS value for the coil type
     coil_type : str, optional
         The coil type, expects either 'X','Y','Z' based on the sheilded rooms reference frame, by default 'Z'
+    N_suh : int, optional
+        The number of surface harmonics in the stream function basis, by default 400
+    sidelength : float, optional
+        The diameter of the spherical target region in m, by default 0.4
+    n : int, optional
+        The number of target grid points along each axis, by default 9
+    abs_error : float, optional
+        The allowed absolute error of the target field, by default 0.01
+    cache : MeshCache | str | bool | None, optional
+        On-disk cache for the mesh basis and coupling matrix, see
+        mesh_cache.get_cache. False disables caching, by default None
+    num_threads : int, optional
+        The number of solver threads, used if backend is not a SolverBackend, by default 8
+    save : bool | str, optional
+        Whether to save the design for later use, see artifacts.save_artifact,
+        to windings_<coil_type>.npz or to the given file, by default True
+    stream_solver : StreamFunctionSolver, optional
+        Solver that is reused across calls, e.g. in a sweep, to warm start from the
+        previous design and keep still valid factorizations. If None, the problem
+        is solved cold with the given backend, by default None
+    backend : SolverBackend | str | None, optional
+        The solver backend when no stream_solver is given, see solvers.get_backend.
+        By default MOSEK if installed, otherwise Clarabel
 
     Returns
     -------
     tuple
         A tuple containing the vertices, faces, stream functions, loops, target points, and target field.
     """
-    
+    import trimesh
+    import pkg_resources
+
     # Load example coil mesh
     coilmesh = trimesh.load(
         file_obj=pkg_resources.resource_filename(
@@ -56,16 +94,11 @@ def generate_windings(coil_type, new_diamater=0.96/2, new_height_scale=0.50/2, n
     )
     ### Adjust the coil mesh for the new radius and height
     ### This is the decided scaling for each of the meshes
-    if coil_type == 'X':
-        n_contours = 3
-        new_diameter = 1.0
-
-    if coil_type == 'Y': 
-        n_contours = 11
-        new_diameter= 0.98
-    if coil_type == 'Z':
-        n_contours = 3 
-        new_diameter = 0.96
+    defaults = COIL_DEFAULTS.get(coil_type, {})
+    if new_diameter is None:
+        new_diameter = defaults.get('new_diameter', 0.96)
+    if n_contours is None:
+        n_contours = defaults.get('n_contours', 3)
     coilmesh1 = coilmesh.copy()
 
     # Adjust the coil mesh vertices for the new radius and height
@@ -74,18 +107,17 @@ def generate_windings(coil_type, new_diamater=0.96/2, new_height_scale=0.50/2, n
 
 
     # Create MeshConductor
-    coil = MeshConductor(
-        verts=coilmesh1.vertices,
-        tris=coilmesh1.faces,
+    coil = mesh_conductor(
+        coilmesh1.vertices,
+        coilmesh1.faces,
         fix_normals=True,
         basis_name="suh",
-        N_suh=400,
+        N_suh=N_suh,
+        cache=cache,
     )
 
     # Define target points
     center = np.array([0, 0, 0])
-    sidelength = 0.4  # 0.4 meter
-    n = 9
     xx = np.linspace(-sidelength / 2, sidelength / 2, n)
     yy = np.linspace(-sidelength / 2, sidelength / 2, n)
     zz = np.linspace(-sidelength / 2, sidelength / 2, n)
@@ -108,18 +140,20 @@ def generate_windings(coil_type, new_diamater=0.96/2, new_height_scale=0.50/2, n
 
     # Create bfield specifications
     target_spec = {
-        "coupling": coil.B_coupling(target_points),
-        "abs_error": 0.01,
+        "coupling": B_coupling(coil, target_points, cache=cache),
+        "abs_error": abs_error,
         "target": target_field,
     }
 
+    if stream_solver is None:
+        stream_solver = StreamFunctionSolver(
+            get_backend(backend, num_threads=num_threads), warm_start=False)
+
     try:
-        coil.s, prob = optimize_streamfunctions(
+        coil.s, prob = stream_solver.solve(
             coil,
             [target_spec],
             objective="minimum_inductive_energy",
-            solver="MOSEK",
-            solver_opts={"mosek_params": {mosek.iparam.num_threads: 8}},
         )
     except Exception as e:
         print(f"Optimization failed: {e}")
@@ -128,26 +162,18 @@ def generate_windings(coil_type, new_diamater=0.96/2, new_height_scale=0.50/2, n
     if coil.s is not None:
         loops = scalar_contour(coil.mesh, coil.s.vert, N_contours=n_contours)
 
-        #Save the data for the coil through Pickle to make use of faster code testing and debugging
-        if coil_type == 'X':
-            with open(f'coilmesh_{coil_type}.pkl', 'wb') as f:
-                pickle.dump({'vertices': coilmesh1.vertices, 'faces': coilmesh1.faces}, f)
-
-            with open(f'loops_{coil_type}.pkl', 'wb') as f:
-                pickle.dump(loops, f)
-
-            with open(f'target_points_{coil_type}.pkl', 'wb') as f:
-                pickle.dump(target_points, f)
-
-        if coil_type == 'Z':
-            with open(f'final_coilmesh_{coil_type}.pkl', 'wb') as f:
-                pickle.dump({'vertices': coilmesh1.vertices, 'faces': coilmesh1.faces}, f)
-
-            with open(f'final_loops_{coil_type}.pkl', 'wb') as f:
-                pickle.dump(loops, f)
-
-            with open(f'final_target_points_{coil_type}.pkl', 'wb') as f:
-                pickle.dump(target_points, f)
+        # Save the design for faster code testing and debugging
+        if save:
+            fname = save if isinstance(save, str) else \
+                f'windings_{coil_type}.npz'
+            save_artifact(fname, loops=loops, params=dict(
+                coil_type=coil_type, new_diameter=new_diameter,
+                new_height_scale=new_height_scale, n_contours=n_contours,
+                N_suh=N_suh, sidelength=sidelength, n=n,
+                abs_error=abs_error),
+                vertices=coil.mesh.vertices, faces=coil.mesh.faces,
+                stream_function=coil.s.vert, target_points=target_points,
+                target_field=target_field, diameter=new_diameter)
 
         return coilmesh1.vertices, coilmesh1.faces, coil.s, loops, target_points, target_field, new_diameter
     else:
@@ -178,7 +204,7 @@ class CylindricalCoil:
         The resistance of the coil in ohms.
     """
 
-    def __init__(self, coil_type):
+    def __init__(self, coil_type, windings=None):
         """
         Initialize the CylindricalCoil class.
 
@@ -192,12 +218,19 @@ class CylindricalCoil:
             How many contours the windings should take, by default 3 (Y is 2).
         coil_type : str, optional
             The coil type, expects either 'X','Y','Z' based on the sheilded rooms reference frame, by default 'X'.
+        windings : tuple, optional
+            The output of generate_windings (e.g. from batch.generate_windings_batch).
+            If None, the windings are generated here.
         """
 
-        vertices, faces, s, loops, target_points, target_field, diameter = generate_windings(coil_type)
+        if windings is None:
+            windings = generate_windings(coil_type)
+        vertices, faces, s, loops, target_points, target_field, diameter = windings
 
         self.vertices = vertices
         self.faces = faces
+        # the vertex values of the stream function, if s is made lazily
+        self._stream_function = None
         self.s = s
         self.loops = loops
         self.target_points = target_points
@@ -206,17 +239,106 @@ class CylindricalCoil:
         self.cu_oz = 2           # oz per ft^2
         self.FCu = list()
         self.BCu = list()
-        self.line_conductor_ = LineConductor(loops=loops)
-        self.flatloops = flatten_loops(loops, coil_type)
         self.coil_type = coil_type
         self.radius = diameter/2
         self.circum = math.pi*2*self.radius *1000
-        self.color = determine_color_auto(self.loops, (0, 0, 0))
+        # made when first used, see the properties
+        self._line_conductor = None
+        self._flatloops = None
+        self._color = None
 
-        # Scale the loops
-        for i, loop in enumerate(self.flatloops):
-            self.flatloops[i][:, 0] = loop[:, 0] * 1000
-            self.flatloops[i][:, 1] = loop[:, 1] * 1000
+    @classmethod
+    def from_artifact(cls, fname, coil_type=None):
+        """Make the coil from a saved design, without optimizing it again.
+
+        Parameters
+        ----------
+        fname : str
+            The design saved by generate_windings, see
+            artifacts.load_artifact.
+        coil_type : str | None
+            The coil type, if it is not in the parameters of the design,
+            e.g. of one converted with load_save.pickles_to_artifact.
+
+        Returns
+        -------
+        coil : CylindricalCoil
+            The coil. The stream function is only rebuilt on the mesh
+            when it is used, e.g. for the inductance.
+        """
+        artifact = load_artifact(fname)
+        params = artifact['params']
+        if coil_type is None:
+            coil_type = params['coil_type']
+        vertices = artifact['vertices']
+        if 'diameter' in artifact:
+            diameter = float(artifact['diameter'])
+        else:
+            diameter = 2 * np.linalg.norm(vertices[:, :2], axis=1).max()
+        windings = (vertices, artifact['faces'], None, artifact['loops'],
+                    artifact['target_points'], artifact.get('target_field'),
+                    diameter)
+        coil = cls(coil_type, windings=windings)
+        coil._stream_function = artifact.get('stream_function')
+        coil.params = params
+        return coil
+
+    @property
+    def s(self):
+        """The stream function."""
+        if self._s is None and self._stream_function is not None:
+            from bfieldtools.mesh_conductor import StreamFunction
+
+            # the vertex basis gives the same field and inductance as the
+            # harmonic basis it was solved in, without computing it
+            conductor = mesh_conductor(np.array(self.vertices),
+                                       np.array(self.faces),
+                                       basis_name='vertex', fix_normals=True)
+            self._s = StreamFunction(np.array(self._stream_function),
+                                     conductor)
+            # metrics.coupling_field reads the stream function from here
+            conductor.s = self._s
+        return self._s
+
+    @s.setter
+    def s(self, s):
+        self._s = s
+
+    @property
+    def line_conductor_(self):
+        """The discretized current loops."""
+        if self._line_conductor is None:
+            from bfieldtools.line_conductor import LineConductor
+
+            self._line_conductor = LineConductor(loops=self.loops)
+        return self._line_conductor
+
+    @line_conductor_.setter
+    def line_conductor_(self, line_conductor):
+        self._line_conductor = line_conductor
+
+    @property
+    def flatloops(self):
+        """The loops flattened onto the board, in mm."""
+        if self._flatloops is None:
+            flatloops = flatten_loops(self.loops, self.coil_type)
+
+            # Scale the loops
+            for loop in flatloops:
+                loop[:, :2] *= 1000
+            self._flatloops = flatloops
+        return self._flatloops
+
+    @flatloops.setter
+    def flatloops(self, flatloops):
+        self._flatloops = flatloops
+
+    @property
+    def color(self):
+        """The color of each loop, by its direction."""
+        if self._color is None:
+            self._color = determine_color_auto(self.loops, (0, 0, 0))
+        return self._color
 
     def predict(self, target_points):
         """Predict the field.
@@ -231,13 +353,17 @@ class CylindricalCoil:
         B_predicted : array, (n_points, 3)
             The predicted field at the target points.
         """
-        B_predicted = self.line_conductor_.magnetic_field(target_points) * 1e-3
+        B_predicted = magnetic_field(conductor_segments(self.line_conductor_),
+                                     target_points) * 1e-3
         return B_predicted @ self.s
 
     def evaluate(self, target_points, target_field,
-                 metrics='all', target_type='dc'):
+                 metrics='all', target_type=None, return_timings=False):
         """Evaluate the coil.
-        
+
+        Each field is computed once and shared between the metrics, see
+        metrics.evaluate.
+
         Parameters
         ----------
         target_points : array, (n_points, 3)
@@ -245,37 +371,44 @@ class CylindricalCoil:
         metrics : str or list, optional
             The metrics to evaluate, by default 'all'.
         target_type : str, optional
-            The target type, by default 'dc'.
+            The target type, e.g. 'dc_y'. By default dc along the largest
+            component of target_field.
+        return_timings : bool, optional
+            Whether to also return the seconds spent per stage, by default False.
 
         Returns
         -------
         dict
             A dictionary containing the evaluation scores.
+        dict
+            The timings, only if return_timings is True.
+
+        Raises
+        ------
+        ValueError
+            If the coil has no stream function, e.g. it was loaded from an
+            artifact saved without it, and a metric needs it.
         """
-        if metrics == 'all':
-            metrics = ['efficiency', 'error', 'homog', 'inductance',
-                       'resistance', 'length', 'target_radius']
-
-        scores = dict()
-        for metric in metrics:
-            if metric == 'efficiency':
-                ef, _ = efficiency(self.line_conductor_, target_points,
-                                   target_type)
-                scores['efficiency (nT/mA)'] = ef
-            elif metric == 'error':
-                err = error(self, target_field, target_points, target_type)
-                scores['error'] = err
-            elif metric == 'homog':
-                hmg = homogeneity(self, target_field, target_points, target_type)
-                scores['homogeneity (%)'] = hmg
-            elif metric == 'inductance':
-                scores['inductance (uH)'] = self.inductance
-            elif metric == 'resistance':
-                scores['resistance (ohm)'] = self.resistance
-            elif metric == 'length':
-                scores['length (m)'] = self.length
-            elif metric == 'target_radius':
-                scores['target radius (cm)'] = target_points[:, 2].max() * 100
+        metrics, _ = evaluation_plan(metrics)
+        coil = None
+        if self.s is not None:
+            coil = self.s.mesh_conductor
+        else:
+            needs_s = [metric for metric in metrics
+                       if metric in ('error', 'homog', 'inductance')]
+            if needs_s:
+                raise ValueError(
+                    f'The metrics {needs_s} need the stream function, which '
+                    f'this coil was saved without.')
+        if target_type is None:
+            ax = np.argmax(np.abs(target_field).sum(axis=0))
+            target_type = 'dc_' + 'xyz'[ax]
+
+        scores, timings = evaluate(coil, self.line_conductor_,
+                                   target_points, target_field, target_type,
+                                   metrics=metrics, properties=self)
+        if return_timings:
+            return scores, timings
         return scores
 
     @property
@@ -312,7 +445,7 @@ class CylindricalCoil:
             loops.append((np.array(loop)))
 
 
-        colors = determine_color_auto(self.loops, (0,0,0))
+        colors = self.color
 
         fig = plt.figure()
         for color, loop in zip(colors, loops):
@@ -340,9 +473,61 @@ class CylindricalCoil:
         #     axes[1].plot(reverse_paths[:, 0], reverse_paths[:, 1], 'g', zorder=0, linewidth=3, alpha=0.6)
         # plt.show()
 
+    def simplify(self, tolerance=0.5, target_points=None):
+        """Coalesce nearly collinear consecutive segments of the loops.
+
+        The flattened loops are simplified, since the board is what is
+        made, and the loops are replaced by the simplified board wrapped
+        back onto the cylinder, so call this before assign_front_back. The
+        first segment of each flattened loop, which export_to_kicad leaves
+        out, is kept as it is.
+
+        Parameters
+        ----------
+        tolerance : float
+            The largest distance of a dropped vertex from the simplified
+            loop on the board, in mm.
+        target_points : array, (n_points, 3) | None
+            Where the field change is computed, by default the target
+            points of the coil.
+
+        Returns
+        -------
+        deviation : float
+            The worst-case change of the field at the target points,
+            relative to the largest field, see simplify.field_deviation.
+        """
+        if target_points is None:
+            target_points = self.target_points
+        masks = coalesce_masks([loop[1:] for loop in self.flatloops],
+                               tolerance)
+        masks = [np.concatenate((np.ones(min(len(loop), 1), dtype=bool),
+                                 mask))
+                 for loop, mask in zip(self.flatloops, masks)]
+
+        # a straight trace on the board is a helix on the cylinder, so the
+        # dropped vertices stay, moved onto the traces
+        snapped = snap_to_coalesced([loop[:, :2] / 1000
+                                     for loop in self.flatloops], masks)
+        radii = [np.linalg.norm(loop[:, :2], axis=1) for loop in self.loops]
+        loops = unflatten_loops(snapped, radii)
+        deviation = field_deviation(self.loops, loops, target_points)
+        n_before = sum(len(loop) for loop in self.flatloops)
+        n_after = sum(mask.sum() for mask in masks)
+        print(f'Simplifying: {n_before} --> {n_after} board vertices, '
+              f'field deviation {deviation * 100:.3g}%')
+
+        self.loops = loops
+        self.flatloops = [loop[mask]
+                          for loop, mask in zip(self.flatloops, masks)]
+        # made again from the new loops when used
+        self.line_conductor_ = None
+        self._color = None
+        return deviation
+
     def assign_front_back(self):
         """Assign front and back loops."""
-        color = determine_color_auto(self.loops, (0, 0, 0))
+        color = self.color
         
         for i, _ in enumerate(self.flatloops):
             if color[i] == 'r':
@@ -352,7 +537,8 @@ class CylindricalCoil:
 
 
     def save(self, pcb_fname, kicad_header_fname, origin,
-             bounds=None, bounds_wholeloop=True, side = None, bound = 0):
+             bounds=None, bounds_wholeloop=True, side = None, bound = 0,
+             tile_size=None):
         """Save the files to be loaded in KICAD.
 
         Parameters
@@ -365,7 +551,42 @@ class CylindricalCoil:
             Save only loops within the bounds expressed in mm.
         origin : tuple of (x, y)
             The origin in mm.
+        side : 'left' | 'right' | None
+            Save only the segments left or right of bound.
+        bound : float
+            The x in mm that side refers to.
+        tile_size : float | tuple of (width, height) | None
+            If given, the bounds are cut into tiles of at most this size in
+            mm, and each tile is saved to its own board, e.g.
+            coil_tile0.kicad_pcb for coil.kicad_pcb. The traces are clipped
+            at the tile edges, see file_io.export_tiles_to_kicad. Without
+            bounds, the tiles cover all traces. side and bound do not apply
+            to tiles.
+
+        Returns
+        -------
+        pcb_fnames : list of str
+            The board files of the tiles, only if tile_size is given.
         """
+        if tile_size is not None:
+            if side is not None:
+                raise ValueError('side and bound cannot be used with '
+                                 'tile_size, use bounds to select the area '
+                                 'to tile.')
+            loops = {'F.Cu': self.FCu, 'B.Cu': self.BCu}
+            if bounds is None:
+                bounds = segment_bounds(loops, origin)
+            tiles = tile_grid(bounds, tile_size)
+            stem, ext = os.path.splitext(pcb_fname)
+            pcb_fnames = [f'{stem}_tile{idx}{ext}'
+                          for idx in range(len(tiles))]
+            export_tiles_to_kicad(pcb_fnames=pcb_fnames,
+                                  kicad_header_fname=kicad_header_fname,
+                                  loops=loops, tiles=tiles, origin=origin,
+                                  net=1, scaling=1,
+                                  trace_width=self.trace_width)
+            return pcb_fnames
+
         # FCu_truncated = list()
         # BCu_truncated = list()
         # for FCu_loop, BCu_loop in zip(self.FCu, self.BCu):
@@ -1,27 +1,136 @@
+import re
 from pathlib import Path
+from collections import OrderedDict, deque
 
 import numpy as np
+from scipy.spatial import cKDTree
 
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-import copy
-
-import pyvista as pv
-import pyvistaqt as pvqt
-
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-
-from bfieldtools.line_conductor import LineConductor
+# pyvista, pyvistaqt and matplotlib are imported by the plotting functions,
+# so that loading boards and computing fields does not need them
+import shapely
+from shapely import STRtree
 from shapely.geometry import LineString
 from shapely.geometry import Point
 
-from .biplanar_coil import get_2D_point_grid
+from . import biot_savart
+from .batch import available_cores
+from .mesh_cache import hash_key, file_hash, get_cache
+
+# bump when the chains built from the same board change
+CHAIN_CACHE_VERSION = 1
+
 
 def segment_len(seg):
     return (((seg[0][1]-seg[1][1])**2) + ((seg[0][2] - seg[1][2])**2))**.5
 
 
+def _kicad_depth(data, start_depth=0):
+    """The nesting depth after each byte of an S-expression."""
+    chars = np.frombuffer(data, dtype=np.uint8)
+    quotes = chars == ord('"')
+    quotes[1:] &= chars[:-1] != ord('\\')
+    # parentheses in quoted strings do not count
+    outside = np.cumsum(quotes) % 2 == 0
+    step = (chars == ord('(')).view(np.int8) - (chars == ord(')')).view(np.int8)
+    step[~outside] = 0
+    return start_depth + np.cumsum(step, dtype=np.int32)
+
+
+def _kicad_records(fp, names, fields, block_size=2 ** 22):
+    """Stream the records with the given names from a KiCad board.
+
+    The file is read in one pass, block by block. Each block is split into
+    records by its nesting depth, computed with numpy, and the fields are
+    matched with one regular expression, so that the work per record is
+    done in C. This works for records on one line, as in KiCad 5 and
+    earlier, as well as for records spanning several lines, as in KiCad 6
+    and later.
+
+    Parameters
+    ----------
+    fp : file
+        The board file, opened in binary mode.
+    names : tuple of str
+        The record names, e.g. ('segment', 'via').
+    fields : tuple of str
+        The field names, e.g. ('start', 'end', 'layer').
+    block_size : int
+        The number of bytes read at a time.
+
+    Yields
+    ------
+    record_names : array of str, shape (n_records,)
+        The names of the records in a block.
+    values : dict of array of str, shape (n_records, 2)
+        The first one or two values of each field of the records, e.g.
+        ('1.5', '2') for (start 1.5 2) or ('F.Cu', '') for (layer "F.Cu"),
+        and ('', '') where a record does not have the field.
+    """
+    # the start of a record, and a field with its first one or two values
+    record_re = re.compile(rb'\(\s*(%s)[\s)]' %
+                           b'|'.join(re.escape(name.encode())
+                                     for name in names))
+    field_re = re.compile(rb'\((%s)\s+"?([^\s()"]+)"?(?:\s+([^\s()"]+))?' %
+                          b'|'.join(re.escape(field.encode())
+                                    for field in fields))
+    data, depth = b'', 0
+    while True:
+        block = fp.read(block_size)
+        data += block
+        if not data:
+            return
+        depths = _kicad_depth(data, depth)
+        # the ends of the children of the board
+        closes = np.flatnonzero((depths == 1) &
+                                (np.frombuffer(data, np.uint8) == ord(')')))
+        if block:
+            # up to the end of the last complete child of the board
+            if len(closes) == 0:
+                continue
+            cut = closes[-1] + 1
+        else:
+            cut = len(data)
+        chunk, data, depths = data[:cut], data[cut:], depths[:cut]
+        yield _kicad_table(chunk, depths, closes, record_re, field_re,
+                           fields)
+        depth = 1
+        if not block:
+            return
+
+
+def _kicad_table(chunk, depths, closes, record_re, field_re, fields):
+    # the board is at depth 1, the records at depth 2 and their fields at 3
+    matches = list(record_re.finditer(chunk))
+    starts = np.array([match.start() for match in matches], dtype=int)
+    record_names = np.array([match.group(1) for match in matches],
+                            dtype=bytes).astype(str)
+    stops = np.searchsorted(closes, starts)
+    keep = (depths[starts] == 2) & (stops < len(closes))
+    starts, record_names = starts[keep], record_names[keep]
+    stops = closes[stops[keep]]
+
+    positions = np.array([match.start() for match in
+                          field_re.finditer(chunk)], dtype=int)
+    found = np.array(field_re.findall(chunk), dtype=bytes).reshape(-1, 3)
+    owners = np.searchsorted(starts, positions, side='right') - 1
+    direct = np.flatnonzero((owners >= 0) & (depths[positions] == 3))
+    direct = direct[positions[direct] < stops[owners[direct]]]
+    owners, found = owners[direct], found[direct].astype(str)
+
+    values = dict()
+    for field in fields:
+        is_field = np.flatnonzero(found[:, 0] == field)
+        # the first one per record
+        owner, first = np.unique(owners[is_field], return_index=True)
+        values[field] = np.full((len(starts), 2), '', dtype=found.dtype)
+        values[field][owner] = found[is_field[first], 1:]
+    return record_names, values
+
+
 def kicad_to_loops(fname, offset, min_len=.1, mult=1000):
     """Load in front, back and via information from kicad file.
     Applies scaling, offset, and rejection based on input parameters.
@@ -36,45 +145,42 @@ def kicad_to_loops(fname, offset, min_len=.1, mult=1000):
         discard any segment with length smaller than this value.
     mult : float
         scale points according to this multiplier.
-    """
-    with open(fname, 'r') as fp:
-        lines = fp.readlines()
 
+    Returns
+    -------
+    loops : dict
+        The segments of the 'F.Cu' and 'B.Cu' layers, as arrays of shape
+        (n_segments, 2, 3), and the unscaled via positions under 'via', as
+        an array of shape (n_vias, 3).
+    """
     if not offset:
         offset = [0, 0, 0]
-    lines = [line.strip(' ').strip('\n') for line in lines]
-    loops = {'F.Cu': list(), 'B.Cu': list(), 'via': list()}
-    for layer in ['F.Cu', 'B.Cu']:
-        lines_layer = [line for line in lines if line.startswith('(segment')
-                       and layer in line]
-        for line in lines_layer:
-            parts = line.split('(')
-            parts = [part.strip('start').strip('end').strip(' ').strip(')')
-                     for part in parts if part.startswith(('start', 'end'))]
-            xstart, ystart = [float(coord) for coord in parts[0].split(' ')]
-            xend, yend = [float(coord) for coord in parts[1].split(' ')]
-
-            seg = [[offset[0],
-                    xstart / mult + offset[1],
-                    ystart / mult + offset[2]],
-                   [offset[0],
-                    xend / mult + offset[1],
-                    yend / mult + offset[2]]]
-            if segment_len(seg) > min_len:
-                loops[layer].append(seg)
-
-    via_lines = [line for line in lines if line.startswith('(via')
-                 and layer[0] in line and layer[1] in line]
-
-    for line in via_lines:
-        parts = line.split('(')
-        parts = [part.strip('at').strip(' ').strip(')') for part in parts
-                 if part.startswith('at')]
-        x, y = [float(coord) for coord in parts[0].split(' ')]
-
-        via = [0, x, y]
-        loops['via'].append(via)
 
+    fields = ('start', 'end', 'layer', 'at')
+    names, values = list(), {field: list() for field in fields}
+    with open(fname, 'rb') as fp:
+        for block_names, block_values in _kicad_records(
+                fp, ('segment', 'via'), fields):
+            names.append(block_names)
+            for field in fields:
+                values[field].append(block_values[field])
+    names = np.concatenate(names) if names else np.zeros(0, dtype=str)
+    values = {field: np.concatenate(value) if value else
+              np.zeros((0, 2), dtype=str) for field, value in values.items()}
+
+    loops = dict()
+    for layer in ['F.Cu', 'B.Cu']:
+        is_layer = (names == 'segment') & (values['layer'][:, 0] == layer)
+        xy = np.concatenate((values['start'][is_layer],
+                             values['end'][is_layer]), axis=1)
+        segs = np.empty((len(xy), 2, 3))
+        segs[:, :, 0] = offset[0]
+        segs[:, :, 1:] = xy.astype(float).reshape(-1, 2, 2) / mult + offset[1:]
+        lengths = np.linalg.norm(segs[:, 0, 1:] - segs[:, 1, 1:], axis=1)
+        loops[layer] = segs[lengths > min_len]
+
+    vias = values['at'][names == 'via'].astype(float)
+    loops['via'] = np.concatenate((np.zeros((len(vias), 1)), vias), axis=1)
     return loops
 
 
@@ -118,6 +224,11 @@ def do_intersect(seg1, seg2, tol=1e-3):
 def get_chain(segments, tolerance=.02, verbose=True):
     """ Build continous chains from a list of segments
 
+    Two segments are linked where they intersect on a grid with the
+    tolerance as spacing, see :func:`do_intersect`. The candidate pairs are
+    found with a spatial index (STRtree) and tested all at once, so that
+    growing the chains only looks at the segments touching the chain ends.
+
     Parameters
     ----------
     segments : list of line segments (2 3D points)
@@ -128,41 +239,65 @@ def get_chain(segments, tolerance=.02, verbose=True):
         whether to print progress information.
     """
     z_offset = segments[0][0][0]
-    segments = np.array(segments)[:, :, 1:].tolist()  # remove z-coordinate
+    segments = np.array(segments, dtype=float)[:, :, 1:]  # remove z-coordinate
+    # exact repeats of a segment are dropped, keeping the first one
+    _, first = np.unique(segments.reshape(len(segments), -1), axis=0,
+                         return_index=True)
+    segments = segments[np.sort(first)]
+    n_segments = len(segments)
+
+    # snapping to the grid moves each point by less than a grid spacing
+    lines = shapely.linestrings(segments)
+    pairs = STRtree(lines).query(lines, predicate='dwithin',
+                                 distance=2 * tolerance)
+    pairs = pairs[:, pairs[0] < pairs[1]]
+    touching = ~shapely.is_empty(shapely.intersection(
+        lines[pairs[0]], lines[pairs[1]], grid_size=tolerance))
+    pairs = pairs[:, touching]
+    pairs = np.concatenate((pairs, pairs[::-1]), axis=1)
+    pairs = pairs[:, np.lexsort(pairs[::-1])]
+    splits = np.searchsorted(pairs[0], np.arange(1, n_segments))
+    neighbours = [nb.tolist() for nb in np.split(pairs[1], splits)]
+
+    def next_free(seg_idx):
+        free = [nb for nb in neighbours[seg_idx] if not used[nb]]
+        return free[0] if free else n_segments
+
+    # like scanning the remaining segments in order, the first free one
+    # touching the last link is appended, or else prepended if it touches
+    # the first link
     chains = list()
-    print(end='')
-    init_len = len(segments)
-    while len(segments) > 0:
-        chain = [segments[0]]
-        segments.remove(segments[0])
-        keep_looping = True
-        while keep_looping:
-            keep_looping = False
-            for seg in segments:
-                if seg in chain:
-                    segments.remove(seg)
-                    keep_looping = True
-                    break
-                elif do_intersect(seg, chain[-1], tolerance):
-                    chain.append(seg)
-                    segments.remove(seg)
-                    keep_looping = True
-                    break
-                elif do_intersect(seg, chain[0], tolerance):
-                    chain.insert(0, seg)
-                    segments.remove(seg)
-                    keep_looping = True
-                    break
-            if verbose:
-                print(f'\rChains: {len(chains) + 1},' +
-                      f' remaining segments: {len(segments)}/{init_len}      ')
-                loading_bar(1 - len(segments) / init_len)
-                print("\033[F", end='')
-        chain = np.array(chain)
+    used = np.zeros(n_segments, dtype=bool)
+    n_used = 0
+    for start in range(n_segments):
+        if used[start]:
+            continue
+        chain = deque([start])
+        used[start] = True
+        n_used += 1
+        while True:
+            at_end, at_start = next_free(chain[-1]), next_free(chain[0])
+            if at_end == at_start == n_segments:
+                break
+            if at_end <= at_start:
+                chain.append(at_end)
+                used[at_end] = True
+            else:
+                chain.appendleft(at_start)
+                used[at_start] = True
+            n_used += 1
+
+        chain = segments[list(chain)]
         chain_3d = np.zeros((chain.shape[0], chain.shape[1], 3))
         chain_3d[:, :, 1:] = chain
         chain_3d[:, :, 0] = z_offset
         chains.append(chain_3d)
+        if verbose:
+            print(f'\rChains: {len(chains)},' +
+                  f' remaining segments: {n_segments - n_used}/{n_segments}'
+                  '      ')
+            loading_bar(n_used / n_segments)
+            print("\033[F", end='')
 
     if verbose:
         print()
@@ -225,19 +360,7 @@ def combine_chains(chains, precision=2):
     precision : float
         how close segments have to be to count as 'overlapping'
     """
-    for i in range(len(chains)):
-        candidate = chains[0]
-        chains.pop(0)
-
-        for _ in range(len(chains)):
-            for i, chain in enumerate(chains):
-                new_c = link_chains(candidate, chain, precision)
-                if new_c is not None:
-                    candidate = new_c
-                    chains.pop(i)
-                    break
-        chains.append(candidate)
-    return chains
+    return merge_chains(chains, [precision])
 
 
 def combine_while_bypassing(chains, precision):
@@ -250,29 +373,125 @@ def combine_while_bypassing(chains, precision):
     precision : float
         how close points need to be to be considered overlapping.
     """
-    for i in range(len(chains)):
-        if len(chains) == 1:
-            break
-        candidate = chains[0]
-        chains.pop(0)
-        if len(candidate) == 1:
-            chains.append(candidate)
-            continue
+    return merge_chains(chains, [precision], bypass=True)
 
-        found = False
-        for cand in [candidate[1:], candidate[:-1]]:
-            if found:
-                break
-            for i, chain in enumerate(chains):
-                new_c = link_chains(cand, chain, precision)
-                if new_c is not None:
-                    print('Bypassing chain endpoint to join chains.')
-                    candidate = new_c
-                    chains.pop(i)
-                    found = True
-                    break
-        chains.append(candidate)
-    return chains
+
+def _find(parent, idx):
+    # union-find root, halving the path on the way
+    while parent[idx] != idx:
+        parent[idx] = parent[parent[idx]]
+        idx = parent[idx]
+    return idx
+
+
+def merge_chains(chains, tolerances=(.1, .5, 1, 2), bypass=False):
+    """Link chains end to end in one pass, closest ends first.
+
+    Two chains are linked where a point of the end link of one is within
+    the tolerance of a point of the end link of the other, like
+    :func:`link_chains`. The end points of all chains are put in one
+    KD-tree, and the candidate joins are made in order of the tolerances,
+    the closest first, with union-find so that every chain end is joined
+    at most once and no chain is joined into a loop with itself.
+
+    Parameters
+    ----------
+    chains : list of arrays of pairs of points
+        the chains to be combined.
+    tolerances : list of float
+        how close points need to be to be considered overlapping, tried
+        from the smallest to the largest.
+    bypass : bool
+        whether to link the second link from a chain end instead, dropping
+        the end link, like :func:`combine_while_bypassing`. At most one
+        link is dropped per chain.
+
+    Returns
+    -------
+    chains : list of arrays of pairs of points
+        the combined chains. Each keeps the direction of the first of the
+        given chains in it.
+    """
+    chains = [np.asarray(chain) for chain in chains]
+    n_chains = len(chains)
+    if n_chains < 2:
+        return chains
+
+    # the two points of the first and last link of each chain, indexed by
+    # (chain * 2 + end) * 2 + point
+    ends = np.array([[chain[0], chain[-1]] for chain in chains])[..., 1:]
+    tree = cKDTree(ends.reshape(-1, 2))
+    if bypass:
+        # the links next to the ends, of chains that have them
+        inner = np.array([[chain[min(1, len(chain) - 1)],
+                           chain[max(len(chain) - 2, 0)]]
+                          for chain in chains])[..., 1:]
+        candidates = cKDTree(inner.reshape(-1, 2)).sparse_distance_matrix(
+            tree, max(tolerances), output_type='ndarray')
+    else:
+        candidates = tree.sparse_distance_matrix(
+            tree, max(tolerances), output_type='ndarray')
+    end_a, end_b = candidates['i'] // 2, candidates['j'] // 2
+    keep = end_a // 2 != end_b // 2
+    if bypass:
+        keep &= np.array([len(chain) > 1 for chain in chains])[end_a // 2]
+    end_a, end_b, dists = end_a[keep], end_b[keep], candidates['v'][keep]
+
+    # closest first, by tolerance, and each pair of ends once
+    rank = np.searchsorted(sorted(tolerances), dists)
+    order = np.lexsort((end_b, end_a, dists, rank))
+    end_a, end_b = end_a[order], end_b[order]
+
+    parent = list(range(n_chains))
+    # the (chain, end) each chain end is joined to
+    joined = [[None, None] for _ in range(n_chains)]
+    dropped = [None] * n_chains
+    for a, b in zip(end_a.tolist(), end_b.tolist()):
+        chain_a, side_a = divmod(a, 2)
+        chain_b, side_b = divmod(b, 2)
+        if joined[chain_a][side_a] is not None or \
+                joined[chain_b][side_b] is not None:
+            continue
+        if bypass and dropped[chain_a] is not None:
+            continue
+        root_a, root_b = _find(parent, chain_a), _find(parent, chain_b)
+        if root_a == root_b:
+            continue
+        parent[max(root_a, root_b)] = min(root_a, root_b)
+        joined[chain_a][side_a] = (chain_b, side_b)
+        joined[chain_b][side_b] = (chain_a, side_a)
+        if bypass:
+            print('Bypassing chain endpoint to join chains.')
+            dropped[chain_a] = side_a
+
+    for idx, side in enumerate(dropped):
+        if side is not None:
+            chains[idx] = chains[idx][1:] if side == 0 else chains[idx][:-1]
+
+    # walk each group of joined chains from a free end, each group is
+    # ordered by its first chain
+    merged = list()
+    visited = [False] * n_chains
+    for first in range(n_chains):
+        if visited[first]:
+            continue
+        idx = first
+        side = 0
+        while joined[idx][side] is not None:
+            idx, side = joined[idx][side]
+            side = 1 - side
+        links = list()
+        forward = True
+        while idx is not None:
+            visited[idx] = True
+            links.append(chains[idx] if side == 0 else
+                         np.flip(chains[idx], 0))
+            if idx == first:
+                forward = side == 0
+            idx, side = joined[idx][1 - side] or (None, None)
+        chain = np.concatenate(links)
+        merged.append(chain if forward else np.flip(chain, 0))
+    return merged
 
 
 def allign_chain(chain):
@@ -333,6 +552,9 @@ def flip_chains(chain_list):
         flip_chain(chain)
 
 def plot_chains_2D(chains):
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as mcolors
+
     ax = plt.figure().add_subplot()
 
     loops = dict()
@@ -381,6 +603,9 @@ def plot_chains(chains, ax=None, pl=None):
         matplotlib subplot to use. If none, a new one is created.
     """
 
+    import pyvista as pv
+    import matplotlib.colors as mcolors
+
     # if not ax:
     #     ax = plt.figure().add_subplot()
 
@@ -408,33 +633,169 @@ def plot_chains(chains, ax=None, pl=None):
 
 class PCB:  # call the other one BiplanarMesh
 
-    def __init__(self, fname=None, offset=None, loops=None, pcb_dict=None):
+    # number of target point sets whose unit field is kept
+    max_cached_fields = 8
+
+    # chain building settings, part of the chain cache key
+    chain_tolerance = .02
+    merge_tolerances = (.1, .5, 1, 2)
+    bypass_tolerance = 1
+
+    def __init__(self, fname=None, offset=None, loops=None, pcb_dict=None,
+                 cache=None):
+        """A PCB, i.e. one KiCad board, as continuous chains of segments.
+
+        Parameters
+        ----------
+        fname : str | Path | None
+            The KiCad board file. It is only parsed when the chains are
+            not in the cache.
+        offset : list of 3 coordinates | None
+            initial offset for loaded points.
+        loops : dict | None
+            Already loaded segments, see kicad_to_loops.
+        pcb_dict : dict | None
+            Chains stored with to_dict.
+        cache : MeshCache | str | bool | None
+            Where the chains built from fname are kept, keyed by the file
+            content and the chain building settings, see
+            mesh_cache.get_cache.
+        """
+        # the PCB whose chains this one shares, see transformed
+        self._base = None
+        self._sign = 1.
         self.chains = None
+        self._segments = None
+        self._fields = OrderedDict()
+        self.fname = fname
+        self.cache = cache
+        # the transform applied to the board coordinates, see adjust_scale
+        # and adjust_offset
+        self.scale = 1.
+        self.offset = np.zeros(3) if offset is None else \
+            np.array(offset, dtype=float)
 
         if pcb_dict is not None:
             self.chains = pcb_dict['chains']
+            self.scale = pcb_dict.get('scale', self.scale)
+            self.offset = np.array(pcb_dict.get('offset', self.offset))
             return
 
-        if loops is not None:
-            self.loops = loops
-        else:
-            self.loops = kicad_to_loops(fname, offset, mult=1)
+        # parsed on demand, see get_chains
+        self.loops = loops
         self.check = None
 
+    def _cache_key(self):
+        return hash_key('pcb_chains', CHAIN_CACHE_VERSION,
+                        file_hash(self.fname), self.offset.tolist(),
+                        self.chain_tolerance, self.merge_tolerances,
+                        self.bypass_tolerance)
+
+    def _set_chains(self, segments, lengths):
+        self._segments = segments
+        self.chains = np.split(segments, np.cumsum(lengths)[:-1]) \
+            if len(lengths) else list()
+
+    def _load_cached(self, key=None):
+        """Load the chains from the cache, returns whether they were."""
+        cache = None if self.fname is None else get_cache(self.cache)
+        if cache is None:
+            return False
+        arrays = cache.load(key or self._cache_key())
+        if arrays is None:
+            return False
+        self._set_chains(arrays['segments'], arrays['lengths'])
+        print(f'Loaded {len(self.chains)} chains from the cache')
+        return True
+
+    @property
+    def chains(self):
+        """The chains, made from the shared ones when first accessed."""
+        if self._chains is None and self._base is not None:
+            self._materialize()
+        return self._chains
+
+    @chains.setter
+    def chains(self, chains):
+        self._chains = chains
+
+    @property
+    def _shared(self):
+        # whether the chains are still those of the base PCB
+        return self._chains is None and self._base is not None
+
+    def transformed(self):
+        """A PCB sharing the chains of this one, e.g. to place it elsewhere.
+
+        Unlike a deepcopy, the chains are not copied. The new PCB only
+        keeps how it is scaled, moved and flipped relative to this one, and
+        its field is computed from the shared chains at transformed target
+        points. Its own chains are only made when they are accessed, e.g.
+        for plotting.
+
+        Returns
+        -------
+        pcb : PCB
+            The new PCB, to be moved with adjust_scale, adjust_offset and
+            flip.
+        """
+        self.get_chains()
+        pcb = PCB(self.fname, offset=self.offset, cache=self.cache)
+        pcb._base = self
+        pcb._base_scale = pcb.scale = self.scale
+        pcb._base_offset = self.offset.copy()
+        pcb.max_cached_fields = self.max_cached_fields
+        return pcb
+
+    def _to_base(self, points):
+        # the boards are flat, so the transform from the base is a uniform
+        # scaling and a shift: points = ratio * (base - base_offset) + offset
+        ratio = self._base_scale / self.scale
+        return self._base_offset + (points - self.offset) / ratio, ratio
+
+    def _materialize(self):
+        ratio = self._base_scale / self.scale
+        segments = ratio * (self._base.segments - self._base_offset) + \
+            self.offset
+        if self._sign < 0:
+            segments = segments[:, ::-1].copy()
+        self._set_chains(segments, [len(ch) for ch in self._base.chains])
+        self._base, self._sign = None, 1.
+
+    def flip(self):
+        """Reverse the current in all chains, see flip_chains."""
+        if self._shared:
+            self._sign = -self._sign
+        else:
+            flip_chains(self.chains)
+
     def get_chains(self):
-        """Returns continuous loops in pcb, builds them if needed."""
+        """Returns continuous loops in pcb, builds them if needed.
+
+        Chains built from a board file are saved in the cache, and loaded
+        from it as long as the file does not change.
+        """
         if self.chains is not None:
             return self.chains
 
+        cache = None if self.fname is None else get_cache(self.cache)
+        if cache is not None:
+            key = self._cache_key()
+            if self._load_cached(key):
+                return self.chains
+
+        if self.loops is None:
+            self.loops = kicad_to_loops(self.fname, self.offset.tolist(),
+                                        mult=1)
+
         def build_chain(segments, tolerances):
-            chains = get_chain(segments, tolerance=.02)
+            chains = get_chain(segments, tolerance=self.chain_tolerance)
             initial_size = len(chains)
-            for tol in tolerances:
-                chains = combine_chains(chains, tol)
+            chains = merge_chains(chains, tolerances)
             chains = [ch for ch in chains if len(ch) > 1 or segment_len(ch[0]) > 1]
             return chains, initial_size
 
-        tol_iters = [.1, .5, 1, 2]
+        tol_iters = self.merge_tolerances
 
         print('Parsing front...')
         if 'F.Cu' in self.loops.keys() and len(self.loops['F.Cu']) > 0:
@@ -452,11 +813,8 @@ class PCB:  # call the other one BiplanarMesh
 
         print('Combining...', end='\r')
         chains = front_chains + back_chains
-        for tol in tol_iters:
-            chains = combine_chains(chains, tol)
-
-        if len(chains) > 1:
-            chains = combine_while_bypassing(chains, 1)
+        chains = merge_chains(chains, tol_iters)
+        chains = merge_chains(chains, [self.bypass_tolerance], bypass=True)
 
         print(f'Combining: {front_size + back_size} --> {len(chains)}')
 
@@ -464,8 +822,34 @@ class PCB:  # call the other one BiplanarMesh
             allign_chain(chain)
 
         self.chains = chains
+        if cache is not None:
+            # built from the board with the offset of the key, and before
+            # any adjust_scale or adjust_offset, which need the chains
+            cache.save(key, segments=self.segments,
+                       lengths=np.array([len(ch) for ch in self.chains],
+                                        dtype=int))
         return self.chains
 
+    @property
+    def segments(self):
+        """All segments of all chains in one contiguous array.
+
+        The chains are views into it, so that in-place edits of either are
+        seen by the other. It is rebuilt if the chains were replaced, e.g.
+        by a deepcopy.
+        """
+        if self._segments is None or len(self.chains) == 0 or \
+                not all(getattr(chain, 'base', None) is self._segments
+                        for chain in self.chains):
+            chains = [np.asarray(chain, dtype=float) for chain in self.chains]
+            if len(chains) == 0:
+                self._segments = np.zeros((0, 2, 3))
+                return self._segments
+            self._segments = np.concatenate(chains)
+            self.chains[:] = np.split(self._segments,
+                                      np.cumsum([len(ch) for ch in chains])[:-1])
+        return self._segments
+
     def plot(self, ax=None, pl=None):
         """Plots PCB"""
         chains = self.get_chains()
@@ -487,21 +871,39 @@ class PCB:  # call the other one BiplanarMesh
     @property
     def length(self):
         # XXX: todo add repr which prints number of segments
-        total_len = 0
-        for chain in self.chains:
-            for segment in chain:
-                total_len += dist(segment[0], segment[1]) 
-        return total_len
+        if self._shared:
+            return self._base.length * self._base_scale / self.scale
+        segments = self.segments
+        return np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1).sum()
 
     def magnetic_field(self, target_points):
-        """Calculate total magnetic field from both layers for unit current."""
-        field = list()
+        """Calculate total magnetic field from both layers for unit current.
 
-        for chain in self.chains:
-            line_conductor = LineConductor(chain)
-            field.append(line_conductor.magnetic_field(target_points))
-
-        return sum(field)
+        The field is cached per set of target points, keyed by the
+        segments too so that moving or flipping chains is picked up. A PCB
+        sharing its chains (see transformed) uses the cache of its base.
+        """
+        target_points = np.asarray(target_points, dtype=float)
+        if self._shared:
+            # Biot-Savart scales with the inverse of the size
+            base_points, ratio = self._to_base(target_points)
+            return self._base.magnetic_field(base_points) * \
+                (self._sign / ratio)
+
+        # LineConductor treats each segment of a chain as an open line, so
+        # all chains can be evaluated at once
+        segments = self.segments
+        key = hash_key(segments, target_points)
+        if key in self._fields:
+            self._fields.move_to_end(key)
+            return self._fields[key]
+
+        field = biot_savart.magnetic_field(segments, target_points)
+        field.setflags(write=False)
+        self._fields[key] = field
+        if len(self._fields) > self.max_cached_fields:
+            self._fields.popitem(last=False)
+        return field
 
         # for layer in layers:
         #     line_conductor = LineConductor(self.loops[layer])
@@ -509,23 +911,81 @@ class PCB:  # call the other one BiplanarMesh
         # return field['F.Cu'] - field['B.Cu']
 
     def adjust_offset(self, offsets):
-        for segment in self.chains:
-            segment[:, :, 0] = offsets[0]
-            segment[:, :, 1] += offsets[1]
-            segment[:, :, 2] += offsets[2]
+        if not self._shared:
+            segments = self.segments
+            segments[:, :, 0] = offsets[0]
+            segments[:, :, 1] += offsets[1]
+            segments[:, :, 2] += offsets[2]
+        self.offset[0] = offsets[0]
+        self.offset[1:] += offsets[1:]
 
     def adjust_scale(self, mult):
-        for segment in self.chains:
-            segment[:, :, 1:] /= mult
+        if not self._shared:
+            self.segments[:, :, 1:] /= mult
+        self.scale *= mult
+        self.offset[1:] /= mult
 
     def to_dict(self):
         pcb_dict = dict()
         pcb_dict['chains'] = self.chains
+        pcb_dict['scale'] = self.scale
+        pcb_dict['offset'] = self.offset
         return pcb_dict
 
+def _build_chains(fname, cache):
+    # in a worker process, see load_pcbs
+    pcb = PCB(fname, cache=cache)
+    pcb.get_chains()
+    return pcb.segments, [len(chain) for chain in pcb.chains]
+
+
+def load_pcbs(fnames, cache=None, n_jobs=1):
+    """Load boards, building the chains of several at the same time.
+
+    The chains that are not in the cache are built in this process or,
+    with n_jobs other than 1, in worker processes, one board per process.
+    The workers are spawned, so that they import the calling script again,
+    which then needs an ``if __name__ == '__main__':`` guard.
+
+    Parameters
+    ----------
+    fnames : list of str | Path
+        The KiCad board files.
+    cache : MeshCache | str | bool | None
+        Where the chains are kept, see PCB.
+    n_jobs : int | None
+        The number of worker processes. With 1, the default, the chains
+        are built in this process. If None, one per board to build as long
+        as there are cores for it.
+
+    Returns
+    -------
+    pcbs : list of PCB
+        The boards, with their chains.
+    """
+    pcbs = [PCB(fname, cache=cache) for fname in fnames]
+    todo = [pcb for pcb in pcbs if not pcb._load_cached()]
+    if n_jobs is None:
+        n_jobs = available_cores()
+    n_jobs = min(n_jobs, len(todo))
+    if n_jobs <= 1:
+        for pcb in todo:
+            pcb.get_chains()
+        return pcbs
+
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=ctx) as pool:
+        results = pool.map(_build_chains, [pcb.fname for pcb in todo],
+                           [pcb.cache for pcb in todo])
+        for pcb, (segments, lengths) in zip(todo, results):
+            pcb._set_chains(segments, lengths)
+    return pcbs
+
+
 class PCBPanel:
 
-    def __init__(self, pcb_folder=None, half_names=None, standoff=None, rearrange=False, panel_dict=None):
+    def __init__(self, pcb_folder=None, half_names=None, standoff=None, rearrange=False, panel_dict=None,
+                 cache=None, n_jobs=1):
         """A Panel is a collection of PCBs used to cancel one
         gradient/DC component.
 
@@ -539,22 +999,29 @@ class PCBPanel:
         standoff : float
             The standoff between the two biplanar PCBs. Typically,
             this is equal to the length of the PCBs, i.e., 1.4 m.
+        cache : MeshCache | str | bool | None
+            Where the chains of the halves are kept, see PCB.
+        n_jobs : int | None
+            The number of processes building the chains of the halves, by
+            default none besides this one, see load_pcbs.
         """
         self.pcbs = dict()
-        self.chains = dict()
 
         if not pcb_folder and not half_names and not standoff:
             if panel_dict:
                 for key, pcb in panel_dict.items():
                     self.pcbs[key] = PCB(pcb_dict=pcb)
-                    self.chains[key] = self.pcbs[key].chains
             return
 
         pcb_folder = Path(pcb_folder)
         shift_xs = {'left': -standoff / 2.,  # in m
                     'right': standoff / 2.}
 
-        for half_name in half_names:
+        fnames = [pcb_folder / half_name / f'coil_template_{half_name}.kicad_pcb'
+                  for half_name in half_names]
+        halves = load_pcbs(fnames, cache=cache, n_jobs=n_jobs)  # offsets in mm
+
+        for half_name, pcb in zip(half_names, halves):
             if half_name == 'top' or (rearrange and half_name == 'first'):
                 shift_y = -0.75
                 shift_z = 0
@@ -568,17 +1035,19 @@ class PCBPanel:
                 shift_y = -0.75
                 shift_z = -0.75
 
-            fname = pcb_folder / half_name / f'coil_template_{half_name}.kicad_pcb'
-            pcb = PCB(fname)  # offsets in mm
-            pcb.get_chains()
-
+            # left and right share the chains of the half
             for dir, shift_x in shift_xs.items():
                 offset = np.array([shift_x, shift_y, shift_z])
-                offset_pcb = copy.deepcopy(pcb)
+                offset_pcb = pcb.transformed()
                 offset_pcb.adjust_scale(1000)
                 offset_pcb.adjust_offset(offset)
                 self.pcbs[f'{dir}_{half_name}'] = offset_pcb
-                self.chains[f'{dir}_{half_name}'] = offset_pcb.get_chains()
+
+    @property
+    def chains(self):
+        """The chains of each PCB."""
+        return {pcb_name: pcb.get_chains()
+                for pcb_name, pcb in self.pcbs.items()}
 
     @property
     def length(self):
@@ -616,6 +1085,10 @@ class PCBPanel:
     def magnetic_field(self, target_points, current):
         """Calculate total magnetic field from panel.
 
+        The unit field of each PCB is computed once per set of target
+        points, see PCB.magnetic_field, so only the scaling by the current
+        is repeated between calls.
+
         Parameters
         ----------
         current : dict
@@ -631,15 +1104,16 @@ class PCBPanel:
 
     def build_chains(self):
         """Link PCBs into continuous loops."""
-        self.chains.clear()
         for pcb_name, pcb in self.pcbs.items():
             print(f'[[ Parsing {pcb_name} ]]')
-            self.chains[pcb_name] = pcb.get_chains()
+            pcb.get_chains()
             print()
 
     def plot(self, target_points=None, current=None, pl=None, show=True):
         """Plot the PCBs."""
         if pl is None:
+            import pyvistaqt as pvqt
+
             pl = pvqt.BackgroundPlotter()
         for pcb_name, pcb in self.pcbs.items():
             pcb.plot(pl=pl)
@@ -693,6 +1167,8 @@ def plot_panel_profile(panel, current, profile_dir='x', field_component='x',
         whether the panel is a gradient panel
     """
     if not ax:
+        import matplotlib.pyplot as plt
+
         _, ax = plt.subplots()
     points = np.arange(min_pos, max_pos, spacing)
     n_points = np.shape(points)[0]
@@ -730,6 +1206,8 @@ def plot_field_colormap(field, grid, axis, ax=None, colorbar=True,
         whether to show a colorbar.
     """
     if not ax:
+        import matplotlib.pyplot as plt
+
         ax = plt.figure().add_subplot()
 
     opt = {'y': 2, 'x': 1, 'z': 0}
@@ -765,6 +1243,8 @@ def plot_field_arrows(target_points, field, ax=None, field_mult=1e7):
         value by which to multiply field values so they are visible in plot.
     """
     if not ax:
+        import matplotlib.pyplot as plt
+
         ax = plt.figure().add_subplot()
 
     ax.quiver(target_points[:, 0], target_points[:, 1],
@@ -782,7 +1262,8 @@ def check_half_names(pcb_folder):
     return use_names
 
 
-def load_panel(path, standoff=1.4, flip=[], rearrange=False):
+def load_panel(path, standoff=1.4, flip=[], rearrange=False, cache=None,
+               n_jobs=1):
     """Loads and returns PCBPanel
 
     Parameters
@@ -795,6 +1276,12 @@ def load_panel(path, standoff=1.4, flip=[], rearrange=False):
         names of which halves of the pcbs to flip.
     rearrange : bool
         whether to treat 'first/second' halves as 'top/bott'
+    cache : MeshCache | str | bool | None
+        Where the chains of the halves are kept, so that loading the same
+        boards again skips parsing and chaining, see PCB.
+    n_jobs : int | None
+        The number of processes building the chains of the halves, by
+        default none besides this one, see load_pcbs.
 
     Returns
     -------
@@ -807,10 +1294,11 @@ def load_panel(path, standoff=1.4, flip=[], rearrange=False):
         return None
 
     panel = PCBPanel(path, half_names=half_names,
-                     standoff=standoff, rearrange=rearrange)
+                     standoff=standoff, rearrange=rearrange, cache=cache,
+                     n_jobs=n_jobs)
     for item in flip:
-        if item in panel.chains.keys():
-            flip_chains(panel.chains[item])
+        if item in panel.pcbs:
+            panel.pcbs[item].flip()
         else:
             print(f'Cannot flip {item}, not a valid panel.')
     return panel
@@ -837,6 +1325,10 @@ def plot_panel(panel, target_size, n_points, current,
     title : string
         title of the plot
     """
+    import matplotlib.pyplot as plt
+
+    from .biplanar_coil import get_2D_point_grid
+
     center = np.array([0, 0, 0])
     target_points, grid = get_2D_point_grid(center, n=n_points,
                                              sidelength=target_size)
@@ -890,6 +1382,8 @@ def plot_combined_panels(panels, currents, target_points):
     target_points : list of points (3d points ndarray)
         points where to compute fields
     """
+    import pyvistaqt as pvqt
+
     pl = pvqt.BackgroundPlotter()
     for panel in panels:
         panel.plot(pl=pl, show=False)
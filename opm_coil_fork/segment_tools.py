@@ -0,0 +1,224 @@
+"""Scale, move and filter the track segments of KiCad files.
+
+The segments are parsed into one array of points, transformed and filtered
+as arrays, and written back in one go. Everything else in the file, e.g.
+the width, layer, net and uuid of each segment, is kept as it is.
+
+Example::
+
+    python segment_tools.py final_z_segments.txt z_scaled.txt \\
+        --scale 0.38825498 --width 1 --align-min-x 0 --offset 0 98.5
+    python segment_tools.py segments.txt filtered_segments.txt \\
+        --min-x -2000 --scale 0.38825498
+"""
+
+import re
+import argparse
+
+import numpy as np
+
+# a segment with its fields, single- or multi-line, with its own lines
+SEGMENT_RE = re.compile(r'[ \t]*\(segment(?:\s+\([^()]*\))*\s*\)[ \t]*\n?')
+COORD_RE = re.compile(r'\((start|end)\s+([^\s()]+)\s+([^\s()]+)\)')
+WIDTH_RE = re.compile(r'\(width\s+[^\s()]+\)')
+
+
+class SegmentFile:
+    """The segments of a KiCad board or of an excerpt of one.
+
+    Parameters
+    ----------
+    text : str
+        The file content.
+    precision : int
+        The number of decimals of the written coordinates.
+
+    Attributes
+    ----------
+    points : array, shape (n_segments, 2, 2)
+        The start and end point of each segment, in mm.
+    """
+
+    def __init__(self, text, precision=6):
+        self.precision = precision
+        blocks = list(SEGMENT_RE.finditer(text))
+        starts = [block.start() for block in blocks] + [len(text)]
+        ends = [0] + [block.end() for block in blocks]
+        # the text before each segment, and after the last one
+        self._gaps = [text[end:start] for end, start in zip(ends, starts)]
+
+        # each segment split around its start and end, all at once
+        parts = COORD_RE.split('\0'.join(block.group() for block in blocks))
+        if parts[1::4] != ['start', 'end'] * len(blocks):
+            raise ValueError('Expected one start and one end per segment, '
+                             'in that order.')
+        self.points = np.array([parts[2::4], parts[3::4]],
+                               dtype=float).T.reshape(-1, 2, 2)
+        texts = '\0'.join(parts[::4]).split('\0')
+        # the text before the start, between start and end and after the end
+        self._texts = [texts[idx:idx + 3]
+                       for idx in range(0, len(texts) - 2, 3)]
+        self._keep = np.ones(len(blocks), dtype=bool)
+
+    @classmethod
+    def read(cls, fname, precision=6):
+        """Parse the segments of a file."""
+        with open(fname, 'r') as fp:
+            return cls(fp.read(), precision=precision)
+
+    def __len__(self):
+        return len(self.points)
+
+    def transform(self, matrix=None, offset=(0., 0.)):
+        """Apply an affine transform, points @ matrix.T + offset.
+
+        Parameters
+        ----------
+        matrix : array, shape (2, 2) | None
+            The linear part, None for the identity.
+        offset : array, shape (2,)
+            The shift in mm.
+
+        Returns
+        -------
+        self : SegmentFile
+            The segments, for chaining.
+        """
+        if matrix is not None:
+            self.points = self.points @ np.asarray(matrix, dtype=float).T
+        self.points = self.points + np.asarray(offset, dtype=float)
+        return self
+
+    def scale(self, factor):
+        """Scale about the origin, by one factor or one per axis."""
+        return self.transform(np.diag(np.broadcast_to(factor, 2)))
+
+    def offset(self, offset_x=0., offset_y=0.):
+        """Move by offset_x and offset_y in mm."""
+        return self.transform(offset=(offset_x, offset_y))
+
+    def rotate(self, degrees):
+        """Rotate counterclockwise about the origin."""
+        angle = np.deg2rad(degrees)
+        return self.transform([[np.cos(angle), -np.sin(angle)],
+                               [np.sin(angle), np.cos(angle)]])
+
+    def align_min_x(self, x=0.):
+        """Move along x so that the smallest x of the segments is x."""
+        if not self._keep.any():
+            return self
+        return self.offset(x - self.points[self._keep, :, 0].min())
+
+    def filter(self, bounds, tolerance=1e-9):
+        """Drop the segments that are not within the bounds.
+
+        Parameters
+        ----------
+        bounds : tuple of (min_x, max_x, min_y, max_y)
+            The bounds in mm, +-inf for none.
+        tolerance : float
+            How far a kept segment may reach over the bounds, against
+            floating-point issues.
+
+        Returns
+        -------
+        self : SegmentFile
+            The segments, for chaining.
+        """
+        x, y = self.points[:, :, 0], self.points[:, :, 1]
+        self._keep &= ((x.min(axis=1) >= bounds[0] - tolerance) &
+                       (x.max(axis=1) <= bounds[1] + tolerance) &
+                       (y.min(axis=1) >= bounds[2] - tolerance) &
+                       (y.max(axis=1) <= bounds[3] + tolerance))
+        return self
+
+    def set_width(self, width):
+        """Set the width of all segments in mm."""
+        width = f'(width {width:g})'
+        self._texts = [[WIDTH_RE.sub(width, text) for text in texts]
+                       for texts in self._texts]
+        return self
+
+    def to_text(self):
+        """The file content with the kept, transformed segments."""
+        coord = f'%.{self.precision}f'
+        start, end = f'(start {coord} {coord})', f'(end {coord} {coord})'
+        pieces = list()
+        for gap, keep, (head, mid, tail) in zip(self._gaps, self._keep.tolist(),
+                                                self._texts):
+            pieces.append(gap.replace('%', '%%'))
+            if keep:
+                pieces.extend((head.replace('%', '%%'), start,
+                               mid.replace('%', '%%'), end,
+                               tail.replace('%', '%%')))
+        pieces.append(self._gaps[-1].replace('%', '%%'))
+        return ''.join(pieces) % tuple(self.points[self._keep].ravel().tolist())
+
+    def write(self, fname):
+        """Write the file with the kept, transformed segments."""
+        with open(fname, 'w') as fp:
+            fp.write(self.to_text())
+        print(f'Wrote {self._keep.sum()} of {len(self)} segments to {fname}')
+
+
+class _Step(argparse.Action):
+    # collects the operations in the order they are given
+    def __call__(self, parser, namespace, values, option_string=None):
+        steps = getattr(namespace, 'steps', None) or list()
+        steps.append((self.dest, values))
+        namespace.steps = steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+        epilog='The operations are applied in the order they are given.')
+    parser.add_argument('input', help='the file with the segments')
+    parser.add_argument('output', help='the file to write')
+    parser.add_argument('--scale', nargs='+', type=float, action=_Step,
+                        metavar='FACTOR', help='scale, one factor or x y')
+    parser.add_argument('--offset', nargs=2, type=float, action=_Step,
+                        metavar=('X', 'Y'), help='move by x and y in mm')
+    parser.add_argument('--rotate', type=float, action=_Step,
+                        metavar='DEGREES', help='rotate counterclockwise')
+    parser.add_argument('--matrix', nargs=6, type=float, action=_Step,
+                        metavar=('A', 'B', 'C', 'D', 'X', 'Y'),
+                        help='the affine transform [[a, b], [c, d]] + [x, y]')
+    parser.add_argument('--align-min-x', type=float, action=_Step,
+                        metavar='X', help='move so that the smallest x is x')
+    for bound in ('min_x', 'max_x', 'min_y', 'max_y'):
+        parser.add_argument(f'--{bound.replace("_", "-")}', type=float,
+                            action=_Step, metavar=bound[-1].upper(),
+                            help=f'keep the segments with {bound[-1]} '
+                                 f'{">=" if "min" in bound else "<="} '
+                                 f'{bound[-1].upper()}')
+    parser.add_argument('--width', type=float, action=_Step,
+                        help='set the width of all segments in mm')
+    parser.add_argument('--precision', type=int, default=6,
+                        help='the decimals of the written coordinates')
+    args = parser.parse_args(argv)
+
+    segments = SegmentFile.read(args.input, precision=args.precision)
+    print(f'Parsed {len(segments)} segments')
+    for name, values in getattr(args, 'steps', None) or list():
+        if name == 'scale':
+            segments.scale(values if len(values) == 2 else values[0])
+        elif name == 'offset':
+            segments.offset(*values)
+        elif name == 'rotate':
+            segments.rotate(values)
+        elif name == 'matrix':
+            segments.transform(np.reshape(values[:4], (2, 2)), values[4:])
+        elif name == 'align_min_x':
+            segments.align_min_x(values)
+        elif name in ('min_x', 'max_x', 'min_y', 'max_y'):
+            bounds = [-np.inf, np.inf, -np.inf, np.inf]
+            bounds[['min_x', 'max_x', 'min_y', 'max_y'].index(name)] = values
+            segments.filter(bounds)
+        elif name == 'width':
+            segments.set_width(values)
+    segments.write(args.output)
+
+
+if __name__ == '__main__':
+    main()
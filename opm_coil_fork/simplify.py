@@ -0,0 +1,130 @@
+"""Coalescing of nearly collinear consecutive segments of loops.
+
+Contours of a stream function on a fine mesh are long runs of short,
+nearly collinear segments, which bloat the boards without changing the
+field. Vertices are dropped with the Douglas-Peucker algorithm of shapely,
+all loops at once, so that no remaining vertex moves more than the
+tolerance away from the original polyline in the board plane.
+"""
+
+import numpy as np
+import shapely
+
+from biot_savart import magnetic_field, loop_segments
+
+
+def coalesce_masks(loops, tolerance):
+    """The vertices kept when coalescing nearly collinear segments.
+
+    Parameters
+    ----------
+    loops : list of array, shape (n_points, 2 | 3)
+        The polylines. Only the first two coordinates are used, i.e. the
+        loops are expected to be flat, like the board loops.
+    tolerance : float
+        The largest distance of a dropped vertex from the simplified
+        polyline, in the units of the loops.
+
+    Returns
+    -------
+    masks : list of array of bool, shape (n_points,)
+        Which vertices of each loop are kept. The first and last ones
+        always are.
+    """
+    loops = [np.asarray(loop, dtype=float) for loop in loops]
+    masks = [np.ones(len(loop), dtype=bool) for loop in loops]
+    todo = [idx for idx, loop in enumerate(loops) if len(loop) > 2]
+    if not todo:
+        return masks
+
+    # the vertex index rides along as z, which simplify ignores and keeps
+    coords = np.concatenate([np.column_stack((loops[idx][:, :2],
+                                              np.arange(len(loops[idx]))))
+                             for idx in todo])
+    line_index = np.repeat(np.arange(len(todo)),
+                           [len(loops[idx]) for idx in todo])
+    lines = shapely.simplify(shapely.linestrings(coords, indices=line_index),
+                             tolerance)
+    kept, kept_line = shapely.get_coordinates(lines, include_z=True,
+                                              return_index=True)
+    for pos, idx in enumerate(todo):
+        masks[idx][:] = False
+        masks[idx][kept[kept_line == pos, 2].astype(int)] = True
+    return masks
+
+
+def coalesce_loops(loops, tolerance):
+    """Loops with nearly collinear consecutive segments merged.
+
+    Parameters
+    ----------
+    loops : list of array, shape (n_points, 2 | 3)
+        The polylines, see :func:`coalesce_masks`.
+    tolerance : float
+        The largest distance of a dropped vertex from the simplified
+        polyline, in the units of the loops.
+
+    Returns
+    -------
+    loops : list of array
+        The loops with the remaining vertices.
+    """
+    return [np.asarray(loop)[mask]
+            for loop, mask in zip(loops, coalesce_masks(loops, tolerance))]
+
+
+def snap_to_coalesced(loops, masks):
+    """Move the dropped vertices onto the coalesced segments.
+
+    Each dropped vertex is placed on the segment between the kept vertices
+    around it, at the same fraction of the original arc length. This keeps
+    the vertices, e.g. to map the simplified board loops back onto the
+    cylinder, where a straight trace is not a straight line.
+
+    Parameters
+    ----------
+    loops : list of array, shape (n_points, n_dims)
+        The polylines.
+    masks : list of array of bool, shape (n_points,)
+        The kept vertices, see :func:`coalesce_masks`.
+
+    Returns
+    -------
+    loops : list of array, shape (n_points, n_dims)
+        The polylines, with the dropped vertices moved.
+    """
+    snapped = list()
+    for loop, mask in zip(loops, masks):
+        loop = np.asarray(loop, dtype=float)
+        arc = np.concatenate(
+            ([0], np.cumsum(np.linalg.norm(np.diff(loop, axis=0), axis=1))))
+        snapped.append(np.column_stack(
+            [np.interp(arc, arc[mask], coord[mask]) for coord in loop.T]))
+    return snapped
+
+
+def field_deviation(loops, simplified, target_points, close=True):
+    """Worst-case change of the field caused by simplifying loops.
+
+    Parameters
+    ----------
+    loops : list of array, shape (n_points, 3)
+        The original loops.
+    simplified : list of array, shape (n_points, 3)
+        The simplified loops.
+    target_points : array, shape (n_points, 3)
+        The points where the field is compared.
+    close : bool
+        Whether the loops are closed, see biot_savart.loop_segments.
+
+    Returns
+    -------
+    deviation : float
+        The largest norm of the field change, relative to the largest
+        norm of the original field.
+    """
+    before = magnetic_field(loop_segments(loops, close=close), target_points)
+    after = magnetic_field(loop_segments(simplified, close=close),
+                           target_points)
+    return (np.linalg.norm(after - before, axis=1).max() /
+            np.linalg.norm(before, axis=1).max())
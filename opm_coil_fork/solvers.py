@@ -0,0 +1,240 @@
+"""Convex solver backends for the stream function optimization.
+
+A backend bundles the solver name with its thread count and tolerances,
+and keeps a timing record of every solve, e.g.::
+
+    backend = get_backend('CLARABEL', num_threads=4, tolerance=1e-7)
+    generate_windings('X', backend=backend)
+    print(backend.timings)
+"""
+
+import numpy as np
+
+
+class SolverBackend:
+    """Base class of the solver backends.
+
+    Parameters
+    ----------
+    num_threads : int | None
+        The number of solver threads. None leaves it to the solver.
+        Backends without threading ignore it; for those the BLAS threads can
+        be limited per worker process, see batch.split_cores.
+    tolerance : float | None
+        The relative convergence tolerance. None uses the solver default.
+    verbose : bool
+        Whether the solver prints its progress.
+    **solver_opts : dict
+        Further solver specific options, passed on as is.
+
+    Attributes
+    ----------
+    timings : list of dict
+        One record per solve, see :meth:`record`.
+    """
+
+    name = None     # the CVXPY solver name
+    # whether the solver starts from given variable values. MOSEK and
+    # Clarabel through CVXPY ignore them
+    warm_starts = False
+
+    def __init__(self, num_threads=None, tolerance=None, verbose=False,
+                 **solver_opts):
+        self.num_threads = num_threads
+        self.tolerance = tolerance
+        self.verbose = verbose
+        self.solver_opts = solver_opts
+        self.timings = list()
+
+    def __repr__(self):
+        return (f'{type(self).__name__}(num_threads={self.num_threads}, '
+                f'tolerance={self.tolerance})')
+
+    @classmethod
+    def available(cls):
+        """Whether the solver is installed."""
+        import cvxpy as cp
+
+        return cls.name in cp.installed_solvers()
+
+    def _options(self):
+        """The thread and tolerance options in the solver's terms."""
+        return dict()
+
+    def solve_kwargs(self):
+        """Keyword arguments for ``cvxpy.Problem.solve``."""
+        # solver_opts take precedence over the defaults
+        return dict(dict(solver=self.name, verbose=self.verbose,
+                         **self._options()), **self.solver_opts)
+
+    def record(self, n_basis, n_constraints, setup_time, solve_time, status,
+               warm_start=False):
+        """Add a timing record.
+
+        Parameters
+        ----------
+        n_basis : int
+            The number of optimization variables.
+        n_constraints : int
+            The number of constraint rows.
+        setup_time : float
+            Seconds spent building the problem.
+        solve_time : float
+            Seconds spent in the solver.
+        status : str
+            The solver status.
+        warm_start : bool
+            Whether the solve started from a previous solution.
+
+        Returns
+        -------
+        timing : dict
+            The record.
+        """
+        timing = dict(backend=self.name, n_basis=n_basis,
+                      n_constraints=n_constraints, setup_time=setup_time,
+                      solve_time=solve_time, status=status,
+                      warm_start=warm_start)
+        self.timings.append(timing)
+        return timing
+
+
+class MosekBackend(SolverBackend):
+    """MOSEK through CVXPY. Needs a licence."""
+
+    name = 'MOSEK'
+
+    def _options(self):
+        mosek_params = dict()
+        if self.num_threads is not None:
+            mosek_params['MSK_IPAR_NUM_THREADS'] = self.num_threads
+        if self.tolerance is not None:
+            mosek_params['MSK_DPAR_INTPNT_CO_TOL_REL_GAP'] = self.tolerance
+            mosek_params['MSK_DPAR_INTPNT_CO_TOL_PFEAS'] = self.tolerance
+            mosek_params['MSK_DPAR_INTPNT_CO_TOL_DFEAS'] = self.tolerance
+        return dict(mosek_params=mosek_params) if mosek_params else dict()
+
+
+class ClarabelBackend(SolverBackend):
+    """Clarabel interior point solver through CVXPY, licence free."""
+
+    name = 'CLARABEL'
+
+    def _options(self):
+        options = dict()
+        if self.num_threads is not None:
+            options['max_threads'] = self.num_threads
+        if self.tolerance is not None:
+            options['tol_gap_rel'] = self.tolerance
+            options['tol_feas'] = self.tolerance
+        return options
+
+
+class SCSBackend(SolverBackend):
+    """SCS first order solver through CVXPY, licence free."""
+
+    name = 'SCS'
+    warm_starts = True
+
+    def _options(self):
+        if self.tolerance is None:
+            return dict()
+        return dict(eps_abs=self.tolerance, eps_rel=self.tolerance)
+
+
+class OSQPBackend(SolverBackend):
+    """OSQP, licence free.
+
+    Called directly rather than through CVXPY, so that a solver can keep
+    its factorization when only the bounds change and start from a
+    previous solution, see stream_solver.StreamFunctionSolver.
+    """
+
+    name = 'OSQP'
+    warm_starts = True
+
+    @classmethod
+    def available(cls):
+        try:
+            import osqp     # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _options(self):
+        # with its default of 1e-3, OSQP stops a few percent of the
+        # abs_error band outside of the bounds and the polishing fails
+        tolerance = 1e-5 if self.tolerance is None else self.tolerance
+        return dict(verbose=self.verbose, eps_abs=tolerance,
+                    eps_rel=tolerance, polish=True)
+
+    def settings(self):
+        """Keyword arguments for ``osqp.OSQP.setup``."""
+        return dict(self._options(), **self.solver_opts)
+
+
+BACKENDS = {backend.name: backend for backend in
+            (MosekBackend, ClarabelBackend, SCSBackend, OSQPBackend)}
+
+
+def get_backend(backend=None, **kwargs):
+    """Resolve the backend argument used throughout.
+
+    Parameters
+    ----------
+    backend : SolverBackend | str | None
+        A backend, or the name of one in BACKENDS. None picks MOSEK if it is
+        installed and Clarabel otherwise.
+    **kwargs : dict
+        Passed to the backend class if one is created, e.g. num_threads or
+        tolerance.
+
+    Returns
+    -------
+    backend : SolverBackend
+        The backend.
+    """
+    if isinstance(backend, SolverBackend):
+        return backend
+    if backend is None:
+        backend = 'MOSEK' if MosekBackend.available() else 'CLARABEL'
+    try:
+        backend_class = BACKENDS[backend.upper()]
+    except KeyError:
+        raise ValueError(f"Unknown solver backend '{backend}'. Must be one "
+                         f"of {', '.join(BACKENDS)}.")
+    return backend_class(**kwargs)
+
+
+def fastest_backend(timings, n_basis=None):
+    """The backend with the lowest median time per solve.
+
+    Parameters
+    ----------
+    timings : list of dict
+        Timing records, e.g. the timings of several backends concatenated.
+    n_basis : int | None
+        Only consider solves of the closest recorded problem size. If None,
+        all solves are considered.
+
+    Returns
+    -------
+    name : str | None
+        The name of the fastest backend or None if there are no
+        successful solves.
+    """
+    timings = [timing for timing in timings
+               if timing['status'] in ('optimal', 'solved')]
+    if n_basis is not None and timings:
+        closest = min((timing['n_basis'] for timing in timings),
+                      key=lambda size: abs(size - n_basis))
+        timings = [timing for timing in timings
+                   if timing['n_basis'] == closest]
+
+    times = dict()
+    for timing in timings:
+        times.setdefault(timing['backend'], []).append(
+            timing['setup_time'] + timing['solve_time'])
+    if not times:
+        return None
+    return min(times, key=lambda name: np.median(times[name]))
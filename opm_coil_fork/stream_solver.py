@@ -0,0 +1,267 @@
+"""Stream function optimization that reuses work between neighbouring designs."""
+
+import time
+
+import numpy as np
+from scipy.sparse import issparse, csc_matrix, triu
+from scipy.sparse.linalg import lsqr, svds
+
+from solvers import get_backend, OSQPBackend
+from mesh_cache import hash_key
+
+
+def _conductor_key(mesh_conductor):
+    """Content key of a conductor, the same for rebuilt conductors."""
+    basis = mesh_conductor.basis
+    if issparse(basis):
+        basis = basis.tocsr()
+        basis = (basis.data, basis.indices, basis.indptr, basis.shape)
+    else:
+        basis = (np.asarray(basis),)
+    return hash_key(mesh_conductor.mesh.vertices, mesh_conductor.mesh.faces,
+                    mesh_conductor.basis_name,
+                    mesh_conductor.opts.get('N_suh'),
+                    mesh_conductor.resistivity, mesh_conductor.thickness,
+                    *basis)
+
+
+def project_to_basis(mesh_conductor, vert):
+    """Least-squares coefficients of vertex values in the conductor's basis.
+
+    Parameters
+    ----------
+    mesh_conductor : MeshConductor
+        The conductor whose basis is used.
+    vert : array, shape (n_verts,)
+        The stream function values at the mesh vertices.
+
+    Returns
+    -------
+    coeffs : array, shape (n_basis,)
+        The basis coefficients, i.e. ``basis @ coeffs`` approximates vert.
+    """
+    basis = mesh_conductor.basis
+    if issparse(basis):
+        return lsqr(basis, vert)[0]
+    return np.linalg.lstsq(basis, vert, rcond=None)[0]
+
+
+class StreamFunctionSolver:
+    """Solve stream function problems, reusing work from earlier solves.
+
+    Solves the same problem as
+    bfieldtools.coil_optimize.optimize_streamfunctions, but is meant to be
+    kept around when solving a sequence of similar problems, e.g. in a
+    sweep:
+
+    - the objective matrix and its Cholesky factor are kept as long as
+      the mesh and basis of the conductor and the objective stay the
+      same, also if the conductor is built again, e.g. by
+      mesh_cache.mesh_conductor.
+    - the constraint matrix and its scaling are kept as long as the
+      coupling stays the same. Changing only the target or abs_error then
+      only updates the bounds: CVXPY does not canonicalize the problem
+      again, and OSQP keeps its matrix factorization.
+    - the previous solution, projected onto the new basis, is used as the
+      initial guess, for the backends that start from one, i.e. OSQP,
+      which is called directly, and SCS. MOSEK and Clarabel ignore
+      initial values, so with them each solve starts cold.
+
+    The bounds are divided by the largest of them before solving, e.g.
+    the target plus abs_error, so that the solution is of order one. With
+    fields of nT, the absolute tolerances of the solvers would otherwise
+    decide when they stop, far from the optimum. The field of the
+    solution is checked against the bounds afterwards.
+
+    Each solve is timed in ``backend.timings``.
+
+    Parameters
+    ----------
+    backend : SolverBackend | str | None
+        The solver backend, see solvers.get_backend.
+    warm_start : bool
+        Whether to seed the solver with the previous solution, if the
+        backend supports it, see SolverBackend.warm_starts.
+    feasibility_tol : float
+        How far the field may be outside of the bounds, relative to the
+        narrowest band between them, i.e. 2 * abs_error.
+
+    Attributes
+    ----------
+    previous_ : array, shape (n_verts,) | None
+        The vertex-wise stream function of the last solve.
+    """
+
+    def __init__(self, backend=None, warm_start=True, feasibility_tol=1e-2):
+        self.backend = get_backend(backend)
+        self.warm_start = warm_start
+        self.feasibility_tol = feasibility_tol
+        self.previous_ = None
+
+        self._objective_key = None
+        self._quadratic_matrix = None
+        self._P = None
+        self._constraint_matrix = None
+        self._scale = None
+        self._problem = None
+        self._osqp = None
+
+    def _objective(self, mesh_conductor, objective):
+        """Update the objective, returns whether it changed."""
+        from bfieldtools.coil_optimize import _construct_quadratic_objective
+
+        key = (_conductor_key(mesh_conductor), objective)
+        if self._objective_key == key:
+            return False
+
+        if objective == "minimum_inductive_energy":
+            weights = (1, 0)
+        elif objective == "minimum_ohmic_power":
+            weights = (0, 1)
+        else:
+            weights = objective
+        quadratic_matrix = _construct_quadratic_objective(weights,
+                                                          mesh_conductor)
+        self._quadratic_matrix = 0.5 * (quadratic_matrix + quadratic_matrix.T)
+        self._P = None  # factorized on demand
+        self._objective_key = key
+        return True
+
+    def _constraints(self, constraint_matrix):
+        """Update the constraints, returns whether they changed."""
+        if self._constraint_matrix is not None and \
+                np.array_equal(constraint_matrix, self._constraint_matrix):
+            return False
+
+        _, s, _ = svds(constraint_matrix, k=1)
+        self._scale = s[0]
+        self._constraint_matrix = constraint_matrix
+        return True
+
+    def _solve_cvxpy(self, lower_bounds, upper_bounds, x0, rebuild):
+        import cvxpy as cp
+
+        if rebuild or self._problem is None:
+            # only the bounds are parameters, parametrizing the matrices
+            # makes the canonicalization far too expensive
+            if self._P is None:
+                self._P = np.linalg.cholesky(self._quadratic_matrix).T
+            G = self._constraint_matrix / self._scale
+            x = cp.Variable(shape=(G.shape[1],), name="x")
+            lb = cp.Parameter(shape=(G.shape[0],), name="lb")
+            ub = cp.Parameter(shape=(G.shape[0],), name="ub")
+            objective = cp.Minimize((1 / 2) * cp.sum_squares(self._P @ x))
+            self._problem = cp.Problem(objective, [G @ x >= lb, G @ x <= ub])
+
+        for par in self._problem.parameters():
+            par.value = {'lb': lower_bounds, 'ub': upper_bounds}[par.name()]
+        x = self._problem.variables()[0]
+        if x0 is not None:
+            x.value = x0
+
+        # the solvers that warm start also do so from their last solution
+        self._problem.solve(warm_start=self.warm_start and
+                            self.backend.warm_starts,
+                            **self.backend.solve_kwargs())
+        return x.value, self._problem, self._problem.status
+
+    def _solve_osqp(self, lower_bounds, upper_bounds, x0, rebuild):
+        import osqp
+
+        if rebuild or self._osqp is None:
+            H = triu(csc_matrix(self._quadratic_matrix), format='csc')
+            G = csc_matrix(self._constraint_matrix / self._scale)
+            self._osqp = osqp.OSQP()
+            self._osqp.setup(H, np.zeros(H.shape[0]), G, lower_bounds,
+                             upper_bounds, **self.backend.settings())
+        else:
+            # same matrices, the factorization is reused
+            self._osqp.update(l=lower_bounds, u=upper_bounds)
+
+        if x0 is not None:
+            self._osqp.warm_start(x=x0)
+        results = self._osqp.solve()
+        return results.x, results, results.info.status
+
+    def solve(self, mesh_conductor, bfield_specification,
+              objective="minimum_inductive_energy"):
+        """Optimize the stream function.
+
+        Parameters
+        ----------
+        mesh_conductor : MeshConductor
+            The conductor to optimize.
+        bfield_specification : list of dict
+            The field specifications, see optimize_streamfunctions.
+        objective : str | tuple
+            'minimum_inductive_energy', 'minimum_ohmic_power' or the
+            (inductive, resistive) weights.
+
+        Returns
+        -------
+        s : StreamFunction
+            The optimized stream function.
+        problem : cvxpy.Problem | OSQP results
+            The solved problem.
+
+        Raises
+        ------
+        RuntimeError
+            If the solver fails or its solution is outside of the bounds.
+        """
+        from bfieldtools.coil_optimize import _construct_constraints
+        from bfieldtools.mesh_conductor import StreamFunction
+
+        t0 = time.perf_counter()
+        constraint_matrix, upper_bounds, lower_bounds = \
+            _construct_constraints(mesh_conductor, bfield_specification)
+        objective_changed = self._objective(mesh_conductor, objective)
+        constraints_changed = self._constraints(constraint_matrix)
+        rebuild = objective_changed or constraints_changed
+        # the solution scales with the bounds, see the class docstring
+        bound_scale = max(np.abs(lower_bounds).max(),
+                          np.abs(upper_bounds).max())
+        if bound_scale == 0:
+            bound_scale = 1.
+        lower_bounds = lower_bounds / bound_scale
+        upper_bounds = upper_bounds / bound_scale
+
+        # the bounds were already handled in the current basis,
+        # only seed from a different design
+        x0 = None
+        if self.warm_start and self.backend.warm_starts and rebuild and \
+                self.previous_ is not None and \
+                len(self.previous_) == len(mesh_conductor.mesh.vertices):
+            x0 = project_to_basis(mesh_conductor, self.previous_) * \
+                self._scale / bound_scale
+
+        t1 = time.perf_counter()
+        if isinstance(self.backend, OSQPBackend):
+            x, problem, status = self._solve_osqp(lower_bounds, upper_bounds,
+                                                  x0, rebuild)
+        else:
+            x, problem, status = self._solve_cvxpy(lower_bounds, upper_bounds,
+                                                   x0, rebuild)
+        t2 = time.perf_counter()
+        self.backend.record(constraint_matrix.shape[1],
+                            constraint_matrix.shape[0], t1 - t0, t2 - t1,
+                            status, warm_start=x0 is not None)
+        if x is None or status not in ('optimal', 'optimal_inaccurate',
+                                       'solved', 'solved inaccurate'):
+            raise RuntimeError(f'{self.backend.name} failed: {status}')
+
+        field = self._constraint_matrix @ x / self._scale
+        violation = np.maximum(lower_bounds - field, field - upper_bounds)
+        band = np.min(upper_bounds - lower_bounds)
+        if violation.max() > self.feasibility_tol * max(band, 1e-6):
+            raise RuntimeError(
+                f'{self.backend.name} returned a field outside of the bounds '
+                f'by {violation.max() / max(band, 1e-6):.3g} times the '
+                f'abs_error band ({status}). Try a smaller tolerance or '
+                f'another backend.')
+
+        # undo the scaling of the constraints and bounds
+        s = StreamFunction(x * bound_scale / self._scale,
+                           mesh_conductor=mesh_conductor)
+        self.previous_ = np.asarray(s.vert)
+        return s, problem
@@ -0,0 +1,351 @@
+"""Sweep cylindrical coil design parameters and store the scores.
+
+Example::
+
+    python sweep.py results.npz --coil-type Z \\
+        --grid new_diameter=0.92,0.96,1.0 --grid n_contours=3,5,7
+    python sweep.py results.npz --show --where coil_type=Z
+"""
+
+import os
+import json
+import time
+import argparse
+import numbers
+import itertools
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from batch import split_cores, _init_worker
+from mesh_cache import hash_key
+
+# The field component each coil nulls, see generate_windings
+TARGET_TYPES = {'X': 'dc_y', 'Y': 'dc_z', 'Z': 'dc_x'}
+
+# Per worker process and coil type, so that consecutive designs in a
+# worker are warm started from each other
+_stream_solvers = dict()
+
+
+def param_grid(**params):
+    """All combinations of the given parameter values.
+
+    Parameters
+    ----------
+    **params : dict of list
+        Keyword arguments of generate_windings and the values to try.
+
+    Returns
+    -------
+    designs : list of dict
+        One dict per combination.
+    """
+    names = list(params)
+    return [dict(zip(names, values))
+            for values in itertools.product(*params.values())]
+
+
+def _normalize(value):
+    # 3 and 3.0 are the same design
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (list, tuple)):
+        return [_normalize(val) for val in value]
+    return value
+
+
+def design_key(design):
+    """Key identifying a design by its parameters.
+
+    Numbers are compared by value, e.g. n_contours=3 and n_contours=3.0
+    have the same key.
+    """
+    return hash_key(sorted((name, _normalize(value))
+                           for name, value in design.items()))
+
+
+class ResultStore:
+    """Columnar .npz store with one row per design.
+
+    Parameters
+    ----------
+    fname : str | Path
+        The results file. Existing results are loaded from it.
+    """
+
+    def __init__(self, fname):
+        self.fname = Path(fname)
+        self.columns = dict()
+        self._n_rows = 0
+        self._keys = set()
+        if self.fname.exists():
+            with np.load(self.fname, allow_pickle=False) as data:
+                self.columns = {name: data[name].tolist()
+                                for name in data.files}
+            self._n_rows = len(next(iter(self.columns.values()), []))
+        self._keys = set(self.columns.get('key', []))
+
+    def __len__(self):
+        return self._n_rows
+
+    def __contains__(self, design):
+        return design_key(design) in self._keys
+
+    def append(self, row):
+        """Add a row. Columns missing on either side are left empty."""
+        for name in row:
+            if name not in self.columns:
+                self.columns[name] = [None] * self._n_rows
+        for name, values in self.columns.items():
+            values.append(row.get(name))
+        self._keys.add(row.get('key'))
+        self._n_rows += 1
+
+    def column(self, name):
+        """A column as an array, with nan or '' for empty cells."""
+        values = self.columns[name]
+        if all(isinstance(val, str) for val in values if val is not None):
+            return np.array(['' if val is None else val for val in values])
+        return np.array([np.nan if val is None else val for val in values],
+                        dtype=float)
+
+    def save(self):
+        """Write the results, replacing the file atomically."""
+        tmp_fname = self.fname.with_name(self.fname.name + '.tmp')
+        with open(tmp_fname, 'wb') as fp:
+            np.savez(fp, **{name: self.column(name) for name in self.columns})
+        os.replace(tmp_fname, self.fname)
+
+    def query(self, **conditions):
+        """Select the rows where the columns equal the given values.
+
+        Returns
+        -------
+        results : dict of array
+            The matching rows, column by column.
+        """
+        mask = np.ones(self._n_rows, dtype=bool)
+        for name, value in conditions.items():
+            mask &= self.column(name) == value
+        return {name: self.column(name)[mask] for name in self.columns}
+
+
+def evaluate_design(design, num_threads=8, cache=None, warm_start=True,
+                    backend=None, tolerance=None):
+    """Generate one design and score it.
+
+    Parameters
+    ----------
+    design : dict
+        Keyword arguments of generate_windings, must contain coil_type.
+    num_threads : int
+        The number of solver threads.
+    cache : MeshCache | str | bool | None
+        See mesh_cache.get_cache.
+    warm_start : bool
+        Whether to start from the previous solution of the same coil type
+        in this process, see stream_solver.StreamFunctionSolver. Only the
+        OSQP and SCS backends start from it.
+    backend : str | None
+        The solver backend name, see solvers.get_backend.
+    tolerance : float | None
+        The solver tolerance, None for the solver default.
+
+    Returns
+    -------
+    row : dict
+        The design parameters, the scores and the status.
+    """
+    from new_coil_generation import generate_windings, CylindricalCoil
+    from metrics import evaluate
+    from solvers import get_backend
+    from stream_solver import StreamFunctionSolver
+
+    row = dict(design, key=design_key(design), status='ok')
+    coil_type = design['coil_type']
+    if coil_type not in _stream_solvers:
+        _stream_solvers[coil_type] = StreamFunctionSolver(
+            get_backend(backend, num_threads=num_threads,
+                        tolerance=tolerance),
+            warm_start=warm_start)
+    stream_solver = _stream_solvers[coil_type]
+    n_timings = len(stream_solver.backend.timings)
+
+    t0 = time.time()
+    windings = generate_windings(num_threads=num_threads, cache=cache,
+                                 save=False, stream_solver=stream_solver,
+                                 **design)
+    row['backend'] = stream_solver.backend.name
+    if len(stream_solver.backend.timings) > n_timings:
+        timing = stream_solver.backend.timings[-1]
+        row['solve time (s)'] = timing['setup_time'] + timing['solve_time']
+        row['n_basis'] = timing['n_basis']
+    if windings[2] is None:
+        row['status'] = 'optimization failed'
+        row['time (s)'] = time.time() - t0
+        return row
+
+    coil = CylindricalCoil(coil_type, windings=windings)
+    target_type = TARGET_TYPES[coil_type]
+    mesh_conductor = coil.s.mesh_conductor
+
+    scores, _ = evaluate(mesh_conductor, coil.line_conductor_,
+                         coil.target_points, coil.target_field, target_type,
+                         metrics=['efficiency', 'error', 'homog', 'length',
+                                  'resistance', 'inductance'],
+                         properties=coil)
+    scores['error (%)'] = scores.pop('error')
+    row.update(scores)
+    row['time (s)'] = time.time() - t0
+    return row
+
+
+def run_sweep(designs, fname, n_workers=None, n_cores=None, cache=None,
+              warm_start=True, backend=None, tolerance=None, save_every=10):
+    """Evaluate designs in parallel, writing the rows as they finish.
+
+    Designs that are already in the results file are skipped, so an
+    interrupted sweep can simply be restarted.
+
+    Parameters
+    ----------
+    designs : list of dict
+        Keyword arguments of generate_windings, see :func:`param_grid`.
+    fname : str | Path
+        The results file.
+    n_workers : int | None
+        The number of worker processes, see batch.split_cores.
+    n_cores : int | None
+        The number of cores to use, see batch.split_cores.
+    cache : MeshCache | str | bool | None
+        See mesh_cache.get_cache.
+    warm_start : bool
+        Whether workers start each solve from their previous solution.
+        Only the OSQP and SCS backends start from it.
+    backend : str | None
+        The solver backend name, see solvers.get_backend. Comparing the
+        'solve time (s)' column of sweeps with different backends, e.g.
+        with solvers.fastest_backend, shows which is fastest per size.
+    tolerance : float | None
+        The solver tolerance, None for the solver default.
+    save_every : int
+        Write the file after this many finished designs, and at the end.
+        The whole file is rewritten each time, so writing after every
+        design would make the sweep quadratic in the number of designs.
+
+    Returns
+    -------
+    store : ResultStore
+        All results in the file.
+    """
+    store = ResultStore(fname)
+    todo = [design for design in designs if design not in store]
+    print(f'{len(designs) - len(todo)} designs already done, '
+          f'{len(todo)} to go')
+    if len(todo) == 0:
+        return store
+
+    n_workers, n_threads = split_cores(len(todo), n_workers, n_cores)
+    ctx = multiprocessing.get_context('spawn')
+    n_unsaved = 0
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx,
+                                 initializer=_init_worker,
+                                 initargs=(n_threads,)) as pool:
+            futures = {pool.submit(evaluate_design, design, n_threads, cache,
+                                   warm_start, backend, tolerance): design
+                       for design in todo}
+            for idx, future in enumerate(as_completed(futures)):
+                design = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    row = dict(design, key=design_key(design),
+                               status=f'failed: {e}')
+                store.append(row)
+                n_unsaved += 1
+                if n_unsaved >= save_every:
+                    store.save()
+                    n_unsaved = 0
+                print(f'[{idx + 1}/{len(todo)}] {design}: {row["status"]}')
+    finally:
+        # also keep the finished designs of an interrupted sweep
+        if n_unsaved:
+            store.save()
+    return store
+
+
+def _parse_value(value):
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _parse_assignments(assignments, multiple):
+    params = dict()
+    for assignment in assignments:
+        name, values = assignment.split('=', 1)
+        values = [_parse_value(val) for val in values.split(',')]
+        params[name] = values if multiple else values[0]
+    return params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('results', help='the .npz results file')
+    parser.add_argument('--coil-type', nargs='+', default=['X', 'Y', 'Z'],
+                        help='the coil types to sweep')
+    parser.add_argument('--grid', action='append', default=[],
+                        metavar='NAME=V1,V2,...',
+                        help='values of a generate_windings parameter')
+    parser.add_argument('--designs', help='json file with a list of designs')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cores', type=int, default=None)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use the mesh cache')
+    parser.add_argument('--cold', action='store_true',
+                        help='do not warm start from previous designs, '
+                             'only OSQP and SCS warm start')
+    parser.add_argument('--backend', default=None,
+                        help='the solver backend, e.g. MOSEK, CLARABEL, '
+                             'OSQP or SCS')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='the solver tolerance')
+    parser.add_argument('--save-every', type=int, default=10,
+                        help='write the results after this many designs')
+    parser.add_argument('--show', action='store_true',
+                        help='print stored results instead of sweeping')
+    parser.add_argument('--where', action='append', default=[],
+                        metavar='NAME=VALUE', help='filter for --show')
+    args = parser.parse_args(argv)
+
+    if args.show:
+        results = ResultStore(args.results).query(
+            **_parse_assignments(args.where, multiple=False))
+        columns = [name for name in results if name != 'key']
+        print('\t'.join(columns))
+        for row in zip(*(results[name] for name in columns)):
+            print('\t'.join(f'{val:.4g}' if isinstance(val, float) else
+                            str(val) for val in row))
+        return
+
+    if args.designs:
+        with open(args.designs) as fp:
+            designs = json.load(fp)
+    else:
+        designs = param_grid(coil_type=args.coil_type,
+                             **_parse_assignments(args.grid, multiple=True))
+    run_sweep(designs, args.results, n_workers=args.workers,
+              n_cores=args.cores, cache=False if args.no_cache else None,
+              warm_start=not args.cold, backend=args.backend,
+              tolerance=args.tolerance, save_every=args.save_every)
+
+
+if __name__ == '__main__':
+    main()
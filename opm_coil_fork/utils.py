@@ -1,6 +1,10 @@
 """Utils."""
+import numpy as np
+import scipy.optimize
 from bfieldtools.line_conductor import LineConductor
 
+from biot_savart import magnetic_field, conductor_segments
+
 def separate_loops(loops, standoff):
     """Separate the loops."""
     current_loops_separate = dict(L=list(), R=list())
@@ -14,46 +18,142 @@ def separate_loops(loops, standoff):
     return line_conductor_separate
 
 
-def optimize_currents_analytic(f_dc, f_grad, line_conductor_separate, target_points_y,
-                               dy):
-    """Optimize currents i1 and i2 to produce f_dc and f_grad."""
+def response_matrix(line_conductors, target_points):
+    """Field of a unit current in each channel.
 
-    # i1 * n1 + i2 * n2 = f_dc
-    # i1 * n3 - i2 * n4 = f_grad
-    # now solve for i1 and i2
+    Parameters
+    ----------
+    line_conductors : dict | list of LineConductor
+        The conductors of each channel, e.g. from separate_loops.
+    target_points : array, shape (n_points, 3)
+        The points where the field is computed.
 
-    unit_field_same = (line_conductor_separate['L'].magnetic_field(points=target_points_y) +
-                       line_conductor_separate['R'].magnetic_field(points=target_points_y)) * 1e9 * 1e-3
-    unit_field_opposite = (line_conductor_separate['L'].magnetic_field(points=target_points_y) -
-                           line_conductor_separate['R'].magnetic_field(points=target_points_y)) * 1e9 * 1e-3
+    Returns
+    -------
+    response : array, shape (n_points, 3, n_channels)
+        The field in nT / mA, so that ``response @ currents`` is the field
+        for the given channel currents in mA.
+    """
+    if isinstance(line_conductors, dict):
+        line_conductors = list(line_conductors.values())
+    return np.stack([magnetic_field(conductor_segments(line_conductor),
+                                    target_points) * 1e9 * 1e-3
+                     for line_conductor in line_conductors], axis=-1)
 
-    n1 = same_eta_dc = np.mean(unit_field_same[:, 2])
-    n3 = same_eta_grad = np.mean(np.diff(unit_field_same[:, 2])) / dy
-    n2 = opposite_eta_dc = np.mean(unit_field_opposite[:, 2])
-    n4 = opposite_eta_grad = np.mean(np.diff(unit_field_opposite[:, 2])) / dy
 
-    i1 = (f_dc * n4 + f_grad * n2) / (n1 * n4 + n3 * n2)
-    i2 = (f_dc * n3 - f_grad * n1) / (n2 * n3 + n4 * n1)
+def dc_gradient_rows(response, target_points, component=2, axis=1):
+    """Rows mapping channel currents to the dc field and gradient.
 
-    return i1, i2
+    The dc field is the mean of the field at the first and last target
+    point, the gradient the difference divided by their distance along axis.
+
+    Parameters
+    ----------
+    response : array, shape (n_points, 3, n_channels)
+        The unit field of each channel, see response_matrix.
+    target_points : array, shape (n_points, 3)
+        The points, ordered along the gradient axis.
+    component : int
+        The field component.
+    axis : int
+        The gradient axis.
+
+    Returns
+    -------
+    rows : array, shape (2, n_channels)
+        The dc and gradient rows.
+    """
+    first, last = response[0, component], response[-1, component]
+    dist = target_points[0, axis] - target_points[-1, axis]
+    return np.array([(first + last) / 2, (first - last) / dist])
+
+
+def solve_currents(rows, targets, bounds=None):
+    """Channel currents that best produce the targets.
+
+    Parameters
+    ----------
+    rows : array, shape (n_targets, n_channels)
+        The linear map from channel currents to target quantities, e.g.
+        dc_gradient_rows or rows of response_matrix.
+    targets : array, shape (n_targets,)
+        The target quantities.
+    bounds : tuple of (float | array) | None
+        Lower and upper current bounds. If None, the unbounded least
+        squares (or exact, for square rows) solution is returned.
+
+    Returns
+    -------
+    currents : array, shape (n_channels,)
+        The channel currents.
+    """
+    rows = np.asarray(rows, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    if bounds is None:
+        return np.linalg.lstsq(rows, targets, rcond=None)[0]
+    return scipy.optimize.lsq_linear(rows, targets, bounds=bounds).x
+
+
+def optimize_currents_analytic(f_dc, f_grad, line_conductor_separate,
+                               target_points_y, dy):
+    """Optimize currents i1 and i2 to produce f_dc and f_grad.
+
+    The closed-form solution of
+
+        i1 * n1 + i2 * n2 = f_dc
+        i1 * n3 - i2 * n4 = f_grad
+
+    with n1, n3 the mean field and gradient over all points for the same
+    current on the L and R sides, n2, n4 for opposite currents, see
+    optimize_currents.
+
+    Parameters
+    ----------
+    f_dc : float
+        The dc field in nT.
+    f_grad : float
+        The gradient in nT / m.
+    line_conductor_separate : dict of LineConductor
+        The L and R conductors, see separate_loops.
+    target_points_y : array, shape (n_points, 3)
+        The points, evenly spaced along y.
+    dy : float
+        The spacing of target_points_y along y.
+
+    Returns
+    -------
+    i1, i2 : float
+        The currents in mA.
+    """
+    return optimize_currents(f_dc, f_grad, line_conductor_separate,
+                             target_points_y, dy=dy)
 
-def optimize_currents(f_dc, f_grad, line_conductor_separate, target_points_y):
-    """Get currents i1 and i2 to produce f_dc and f_grad."""
 
-    def func(x):
-        i1, i2 = x[0], x[1]
-        field = (line_conductor_separate['L'].magnetic_field(points=target_points_y) * (i1 + i2) +
-                 line_conductor_separate['R'].magnetic_field(points=target_points_y) * (i1 - i2)) * 1e9 * 1e-3
-        actual_mean_field = (field[0, 2] + field[-1, 2]) / 2
-        actual_grad_field = (field[0, 2] - field[-1, 2]) / (target_points_y[0, 1] - target_points_y[-1, 1])
-        return (actual_mean_field - f_dc) ** 2 + (actual_grad_field - f_grad) ** 2
+def optimize_currents(f_dc, f_grad, line_conductor_separate, target_points_y,
+                      bounds=None, dy=None):
+    """Get currents i1 and i2 to produce f_dc and f_grad.
 
-    def callback(x):
-        print(x)
+    The L side carries i1 + i2 and the R side i1 - i2. The fields are
+    linear in the currents, so this is solved on the 2 x 2 response
+    matrix, bounds limit i1 and i2 in the same way as for solve_currents.
 
-    res = scipy.optimize.minimize(func, [0, 0], method='COBYLA', callback=callback,
-                                  options={'maxiter': 100})
-    i1, i2 = res.x
+    If dy is None, the dc field and gradient are those of the first and
+    last point, see dc_gradient_rows. Otherwise they are the mean over all
+    points and of their differences divided by dy, and the gradient of i2
+    has the opposite sign, as in optimize_currents_analytic.
+    """
+    response = response_matrix([line_conductor_separate['L'],
+                                line_conductor_separate['R']], target_points_y)
+    # from (L, R) to (i1, i2), i.e. same and opposite currents
+    response = response @ np.array([[1., 1.], [1., -1.]])
+    if dy is None:
+        rows = dc_gradient_rows(response, target_points_y)
+    else:
+        field = response[:, 2]
+        rows = np.array([field.mean(axis=0),
+                         np.diff(field, axis=0).mean(axis=0) / dy])
+        rows[1, 1] *= -1
+    i1, i2 = solve_currents(rows, [f_dc, f_grad], bounds=bounds)
     return i1, i2
 
 